@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from rich import print as rprint
+from rich.console import Console
+from rich.table import Table
+
+from ext.mock.mock_fmc import MockFMC
+from ext.service.acps import add_acp
+from ext.service.AsyncFMC import AsyncFMC
+from ext.service.async_acps import add_acp_async
+from ext.service.FMC import FMC
+
+CSV_HEADER = [
+    "#ACP Policy", "Name", "Category", "Action", "Source Zone", "Destination Zone",
+    "Source Network", "Destination Network", "Source Ports", "Destination Ports",
+]
+
+
+#################################################################################################
+# CSV GENERATOR
+#################################################################################################
+def generate_csv(path, rows, reuse=0.0, policies=4, categories=3):
+    """
+    This method writes an input CSV with generated rules
+    :param rows: Number of rules
+    :param reuse: Fraction of the rows that use a Host/Network/Port already used by a previous row (0.0 to 1.0)
+    :param policies: Number of ACP Policies the rules are spread over
+    :param categories: Number of Categories in each Policy
+    """
+    distinct = max(1, round(rows * (1 - reuse)))
+    with open(path, "w", newline="") as output_file:
+        output_csv = csv.writer(output_file)
+        output_csv.writerow(CSV_HEADER)
+        for row in range(rows):
+            object_number = row % distinct
+            # The destination network and port are shifted on each pass over the objects, so the rows reuse the
+            # objects but never match the same traffic (while rows <= distinct ** 3) and are not skipped as
+            # duplicates
+            network_number = (object_number + row // distinct) % distinct
+            port_number = (object_number + row // distinct // distinct) % distinct
+            output_csv.writerow(
+                [
+                    f"Bench_Policy_{row % policies}",
+                    f"Bench Rule {row}",
+                    f"Category_{row // policies % categories}",
+                    "Allow",
+                    "inside_zone",
+                    "outside_zone",
+                    f"10.{object_number // 65536 % 256}.{object_number // 256 % 256}.{object_number % 256}",
+                    f"172.{16 + network_number // 256 % 16}.{network_number % 256}.0/24",
+                    "",
+                    f"{1 + port_number % 65535}/TCP",
+                ]
+            )
+
+
+#################################################################################################
+# BENCHMARK
+#################################################################################################
+def run_benchmark(mock, rows, reuse, options, workdir):
+    """
+    This method runs add_acp (or add_acp_async) over a generated CSV against an empty mock FMC
+    :param mock: MockFMC already started
+    :param options: Parsed command line options
+    :return: Dict with the results
+    """
+    csv_input = os.path.join(workdir, f"bench_{rows}_{reuse}.csv")
+    generate_csv(csv_input, rows, reuse, options.policies, options.categories)
+
+    # Every run starts with an empty FMC (only the Security Zones)
+    mock.reset()
+    for zone in ("inside_zone", "outside_zone"):
+        mock.add_object("object/securityzones", {"name": zone, "type": "SecurityZone"})
+    fmc = FMC(
+        f"127.0.0.1:{mock.port}",
+        mock.username,
+        mock.password,
+        pool_size=max(10, options.concurrency),
+        rate_limit=options.rate_limit,
+        page_workers=options.page_workers,
+    )
+    acp_options = {"bulk_size": options.bulk_size, "bulk_objects": options.bulk_objects}
+
+    start = time.perf_counter()
+    # The progress messages of each rule would dominate the time, so they are discarded
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        fmc.domain = fmc.token_manager.authenticate()[0]["uuid"]
+        if options.concurrency > 0:
+            status = asyncio.run(
+                add_acp_async(AsyncFMC(fmc, options.concurrency), csv_input, **acp_options)
+            )
+        else:
+            status = add_acp(fmc, csv_input, **acp_options)
+    wall_time = time.perf_counter() - start
+
+    return {
+        "rows": rows,
+        "reuse": reuse,
+        "wall_time": round(wall_time, 3),
+        "rows_per_second": round(rows / wall_time, 1),
+        "api_calls": mock.requests,
+        "api_calls_per_row": round(mock.requests / rows, 2),
+        # IDs never have spaces, while the error messages always do
+        "errors": sum(1 for id in status.values() if " " in id),
+        "endpoints": mock.stats,
+    }
+
+
+def print_results(results):
+    table = Table(title="add_acp benchmark (mock FMC)")
+    for column in ("Rows", "Reuse", "Wall time (s)", "Rows/s", "API calls", "Calls/row", "Errors"):
+        table.add_column(column, justify="right")
+    for result in results:
+        table.add_row(
+            str(result["rows"]),
+            f"{result['reuse']:.0%}",
+            f"{result['wall_time']:.2f}",
+            f"{result['rows_per_second']:.1f}",
+            str(result["api_calls"]),
+            f"{result['api_calls_per_row']:.2f}",
+            str(result["errors"]),
+        )
+    Console().print(table)
+
+
+#################################################################################################
+# MAIN
+#################################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of add_acp against a local mock FMC")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000], help="CSV sizes, ex: 1000 10000 100000")
+    parser.add_argument("--reuse", type=float, nargs="+", default=[0.0, 0.9], help="Fraction of reused objects")
+    parser.add_argument("--policies", type=int, default=4)
+    parser.add_argument("--categories", type=int, default=3)
+    parser.add_argument("--bulk-size", type=int, default=0)
+    parser.add_argument("--bulk-objects", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=0, help="Use add_acp_async with this concurrency")
+    parser.add_argument("--rate-limit", type=int, default=1000000, help="Client rate limit (requests per minute)")
+    parser.add_argument("--page-workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock latency per request (seconds)")
+    parser.add_argument("--page-size", type=int, default=1000, help="Mock maximum items per page")
+    parser.add_argument("--token-lifetime", type=int, default=1800, help="Mock token lifetime (seconds)")
+    parser.add_argument("--inject-429", type=int, default=0, help="Mock answers every Nth request with 429")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    mock = MockFMC(
+        port=0,
+        latency=args.latency,
+        page_size=args.page_size,
+        token_lifetime=args.token_lifetime,
+        inject_429=args.inject_429,
+        retry_after=1,
+    )
+    mock.start()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.rows:
+            for reuse in args.reuse:
+                rprint(f"[italic]Running {rows} rows with {reuse:.0%} object reuse . . .[/italic]")
+                results.append(run_benchmark(mock, rows, reuse, args, workdir))
+    mock.stop()
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json_file.write(json.dumps(results, indent=4))
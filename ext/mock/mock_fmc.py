@@ -0,0 +1,449 @@
+import argparse
+import base64
+import json
+import os
+import re
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DOMAIN_UUID = "e276abec-e0f2-11e3-8169-6d9ed49b625f"
+CONFIG_PATH = re.compile(r"^/api/fmc_config/v1/domain/([^/]+)/(.+)$")
+# Paths with an ID in the middle (ex: policy/accesspolicies/<ID>/accessrules) are counted together in the stats
+ID_IN_PATH = re.compile(r"/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+#################################################################################################
+# MOCK FMC
+#################################################################################################
+class MockFMC:
+    """
+    Local stand-in for the FMC REST API, used to test and benchmark the scripts without a real FMC. It answers the
+    token generation/refresh (with the DOMAINS header), paginated GETs (offset, limit, expanded and nameOrValue
+    filter), single and bulk POSTs (rejecting duplicated names like FMC does) and DELETEs of any object or policy
+    path, keeping everything in memory. Latency, page size, token lifetime and 429 answers can be configured.
+    It listens on HTTPS with a self-signed certificate generated with the openssl command.
+    """
+
+    def __init__(
+        self,
+        port=8443,
+        username="admin",
+        password="admin",
+        latency=0.0,
+        page_size=1000,
+        token_lifetime=1800,
+        max_refreshes=3,
+        inject_429=0,
+        retry_after=1,
+        domains=(),
+    ):
+        """
+        :param latency: Seconds added to each answer
+        :param page_size: Maximum number of items in each page of a GET (FMC allows up to 1000)
+        :param token_lifetime: Seconds a token is accepted
+        :param max_refreshes: Number of times a token can be refreshed
+        :param inject_429: If greater than 0, every Nth request is answered with 429 (Too Many Requests)
+        :param retry_after: Seconds sent in the Retry-After header of the 429 answers
+        :param domains: Names of the child domains, ex: ["Global/Customer1"]. Each domain has its own objects
+        """
+        self.port = port
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.page_size = page_size
+        self.token_lifetime = token_lifetime
+        self.max_refreshes = max_refreshes
+        self.inject_429 = inject_429
+        self.retry_after = retry_after
+        self.domains = {"Global": DOMAIN_UUID}
+        for domain_name in domains:
+            self.domains[domain_name] = str(uuid.uuid4())
+        self.__lock = threading.Lock()
+        self.__collections = {}
+        # Access token -> [time it was issued, number of refreshes]
+        self.__tokens = {}
+        self.__refresh_tokens = {}
+        self.__requests = 0
+        self.__stats = Counter()
+        self.__server = None
+
+    #################################################################################################
+    # DATA
+    #################################################################################################
+    def collection(self, path, domain=DOMAIN_UUID):
+        """
+        This method returns the list of objects of a path, ex: object/hosts
+        :param domain: Domain UUID
+        """
+        with self.__lock:
+            return self.__collections.setdefault((domain, path), [])
+
+    def add_object(self, path, element, domain=DOMAIN_UUID):
+        """
+        This method adds an object to a path, as if it existed in FMC before the run
+        :param path: API Path, ex: object/securityzones
+        :param element: JSON of the object. An ID is generated if it has none
+        :param domain: Domain UUID
+        :return: The object added
+        """
+        element = dict(element)
+        element.setdefault("id", str(uuid.uuid4()))
+        self.collection(path, domain).append(element)
+        return element
+
+    @property
+    def stats(self):
+        """
+        Number of requests by method and path, ex: {"POST object/hosts": 10}
+        """
+        with self.__lock:
+            return dict(self.__stats)
+
+    @property
+    def requests(self):
+        with self.__lock:
+            return self.__requests
+
+    def reset_stats(self):
+        with self.__lock:
+            self.__requests = 0
+            self.__stats.clear()
+
+    def reset(self):
+        """
+        This method removes every object and token and clears the stats
+        """
+        with self.__lock:
+            self.__collections.clear()
+        self.expire_tokens()
+        self.reset_stats()
+
+    def expire_tokens(self):
+        """
+        This method invalidates every token, as if FMC was restarted
+        """
+        with self.__lock:
+            self.__tokens.clear()
+            self.__refresh_tokens.clear()
+
+    #################################################################################################
+    # SERVER
+    #################################################################################################
+    def start(self):
+        """
+        This method starts the HTTPS server in a background thread
+        :return: Address to be used as FMC IP, ex: 127.0.0.1:8443
+        """
+        cert_dir = tempfile.mkdtemp()
+        cert_file = os.path.join(cert_dir, "cert.pem")
+        key_file = os.path.join(cert_dir, "key.pem")
+        subprocess.run(
+            [
+                "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                "-keyout", key_file, "-out", cert_file, "-days", "1", "-subj", "/CN=localhost",
+            ],
+            check=True,
+            capture_output=True,
+        )
+        mock = self
+
+        class Handler(MockFMCHandler):
+            fmc = mock
+
+        self.__server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self.__server.daemon_threads = True
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+        self.__server.socket = context.wrap_socket(self.__server.socket, server_side=True)
+        # Port 0 means any free port
+        self.port = self.__server.server_address[1]
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return f"127.0.0.1:{self.port}"
+
+    def stop(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+    #################################################################################################
+    # API
+    #################################################################################################
+    def handle(self, method, path, query, headers, body):
+        """
+        This method answers a request
+        :return: status code, JSON body, response headers
+        """
+        with self.__lock:
+            self.__requests += 1
+            self.__stats[f"{method} {ID_IN_PATH.sub('/{id}', self.__short_path(path))}"] += 1
+            request_number = self.__requests
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.inject_429 and request_number % self.inject_429 == 0:
+            return 429, {"error": "Too many requests"}, {"Retry-After": str(self.retry_after)}
+        if path == "/api/fmc_platform/v1/auth/generatetoken" and method == "POST":
+            return self.__generate_token(headers)
+        if path == "/api/fmc_platform/v1/auth/refreshtoken" and method == "POST":
+            return self.__refresh_token(headers)
+
+        config_path = CONFIG_PATH.match(path)
+        if not config_path:
+            return 404, {"error": {"messages": [{"description": "Not found"}]}}, {}
+        if not self.__valid_token(headers.get("X-auth-access-token")):
+            return 401, self.__error("Access token invalid."), {}
+        domain = config_path.group(1)
+        if domain not in self.domains.values():
+            return 400, self.__error("Invalid domain."), {}
+
+        object_path = config_path.group(2)
+        if method == "GET":
+            return self.__get(domain, object_path, query)
+        if method == "POST":
+            return self.__post(domain, object_path, query, body)
+        if method == "DELETE":
+            return self.__delete(domain, object_path)
+        return 405, self.__error("Method not allowed."), {}
+
+    def __short_path(self, path):
+        config_path = CONFIG_PATH.match(path)
+        if config_path:
+            return config_path.group(2)
+        return path
+
+    def __error(self, description):
+        return {
+            "error": {
+                "category": "FRAMEWORK",
+                "messages": [{"description": description}],
+                "severity": "ERROR",
+            }
+        }
+
+    def __issue_token(self, refreshes):
+        auth_token = str(uuid.uuid4())
+        refresh_token = str(uuid.uuid4())
+        with self.__lock:
+            self.__tokens[auth_token] = time.monotonic()
+            self.__refresh_tokens[refresh_token] = (auth_token, refreshes)
+        return auth_token, refresh_token
+
+    def __valid_token(self, auth_token):
+        with self.__lock:
+            issued = self.__tokens.get(auth_token)
+        return issued is not None and time.monotonic() - issued < self.token_lifetime
+
+    def __generate_token(self, headers):
+        credentials = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
+        if headers.get("Authorization") != f"Basic {credentials}":
+            return 401, self.__error("Invalid username or password."), {}
+        auth_token, refresh_token = self.__issue_token(0)
+        domains = [
+            {"name": domain_name, "uuid": domain, "type": "DOMAIN"}
+            for domain_name, domain in self.domains.items()
+        ]
+        return (
+            204,
+            None,
+            {
+                "X-auth-access-token": auth_token,
+                "X-auth-refresh-token": refresh_token,
+                "DOMAIN_UUID": DOMAIN_UUID,
+                "DOMAINS": str(domains),
+            },
+        )
+
+    def __refresh_token(self, headers):
+        with self.__lock:
+            refresh = self.__refresh_tokens.get(headers.get("X-auth-refresh-token"))
+        # FMC does not send new tokens after the refresh limit
+        if refresh is None or refresh[0] != headers.get("X-auth-access-token"):
+            return 401, self.__error("Invalid refresh token."), {}
+        if refresh[1] >= self.max_refreshes:
+            return 400, self.__error("Refresh limit reached."), {}
+        with self.__lock:
+            self.__tokens.pop(refresh[0], None)
+            self.__refresh_tokens.pop(headers.get("X-auth-refresh-token"), None)
+        auth_token, refresh_token = self.__issue_token(refresh[1] + 1)
+        return (
+            204,
+            None,
+            {"X-auth-access-token": auth_token, "X-auth-refresh-token": refresh_token},
+        )
+
+    def __get(self, domain, path, query):
+        # A single object, ex: object/hosts/<id>
+        parent, _, id = path.rpartition("/")
+        if ID_IN_PATH.fullmatch(f"/{id}"):
+            for item in self.collection(parent, domain):
+                if item["id"] == id:
+                    return 200, item, {}
+            return 404, self.__error(f"Object {id} not found."), {}
+        items = self.collection(path, domain)
+        if "filter" in query:
+            # Only nameOrValue:<VALUE> is supported
+            value = query["filter"][0].split(":", 1)[-1]
+            items = [
+                item
+                for item in items
+                if value in (item.get("name"), item.get("value"), item.get("port"))
+            ]
+        offset = int(query.get("offset", ["0"])[0])
+        limit = min(int(query.get("limit", ["25"])[0]), self.page_size)
+        expanded = query.get("expanded", ["false"])[0] == "true"
+        count = len(items)
+        page = items[offset : offset + limit]
+        if not expanded:
+            page = [
+                {"id": item["id"], "name": item.get("name"), "type": item.get("type")}
+                for item in page
+            ]
+        paging = {
+            "offset": offset,
+            "limit": limit,
+            "count": count,
+            "pages": (count + limit - 1) // limit,
+        }
+        if offset + limit < count:
+            paging["next"] = [
+                f"https://127.0.0.1:{self.port}/api/fmc_config/v1/domain/{domain}/{path}"
+                f"?offset={offset + limit}&limit={limit}&expanded={str(expanded).lower()}"
+            ]
+        json_resp = {"paging": paging}
+        # FMC does not send the items key when there is nothing to return
+        if page:
+            json_resp["items"] = page
+        return 200, json_resp, {}
+
+    def __post(self, domain, path, query, body):
+        bulk = query.get("bulk", ["false"])[0] == "true"
+        elements = body if bulk else [body]
+        if not isinstance(elements, list) or not elements:
+            return 400, self.__error("Invalid input."), {}
+        if bulk and len(elements) > 1000:
+            return 400, self.__error("Bulk POST supports up to 1000 elements."), {}
+        with self.__lock:
+            items = self.__collections.setdefault((domain, path), [])
+            names = {item.get("name") for item in items}
+            # Like FMC, the whole bulk is rejected if one element fails
+            for element in elements:
+                if element.get("name") in names:
+                    return (
+                        400,
+                        self.__error(
+                            f"The object name {element.get('name')} already exists. Enter a new name."
+                        ),
+                        {},
+                    )
+                names.add(element.get("name"))
+            created = []
+            for element in elements:
+                element = dict(element)
+                element["id"] = str(uuid.uuid4())
+                if "category" in query:
+                    element["metadata"] = {"category": query["category"][0]}
+                items.append(element)
+                created.append(element)
+        if bulk:
+            return 201, {"items": created}, {}
+        return 201, created[0], {}
+
+    def __delete(self, domain, path):
+        parent, _, id = path.rpartition("/")
+        with self.__lock:
+            items = self.__collections.get((domain, parent), [])
+            for index, item in enumerate(items):
+                if item["id"] == id:
+                    del items[index]
+                    return 200, item, {}
+        return 404, self.__error(f"Object {id} not found."), {}
+
+
+class MockFMCHandler(BaseHTTPRequestHandler):
+    # Set by MockFMC.start
+    fmc = None
+    # Keep the connections alive like FMC does, so the client pool is exercised
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so Nagle would delay each answer by the client delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def __answer(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = None
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                body = None
+        status, json_resp, headers = self.fmc.handle(
+            method, url.path, parse_qs(url.query), self.headers, body
+        )
+        data = json.dumps(json_resp).encode() if json_resp is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.__answer("GET")
+
+    def do_POST(self):
+        self.__answer("POST")
+
+    def do_PUT(self):
+        self.__answer("PUT")
+
+    def do_DELETE(self):
+        self.__answer("DELETE")
+
+
+#################################################################################################
+# MAIN
+#################################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the FMC REST API")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to each answer")
+    parser.add_argument("--page-size", type=int, default=1000, help="Maximum items per page")
+    parser.add_argument("--token-lifetime", type=int, default=1800, help="Seconds a token is accepted")
+    parser.add_argument("--inject-429", type=int, default=0, help="Answer every Nth request with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of the 429 answers")
+    parser.add_argument("--domains", nargs="*", default=[], help="Child domains, ex: Global/Customer1")
+    args = parser.parse_args()
+
+    mock = MockFMC(
+        port=args.port,
+        username=args.username,
+        password=args.password,
+        latency=args.latency,
+        page_size=args.page_size,
+        token_lifetime=args.token_lifetime,
+        inject_429=args.inject_429,
+        retry_after=args.retry_after,
+        domains=args.domains,
+    )
+    for domain in mock.domains.values():
+        for zone in ("inside_zone", "outside_zone"):
+            mock.add_object("object/securityzones", {"name": zone, "type": "SecurityZone"}, domain)
+    print(f"Mock FMC listening on https://{mock.start()} (user {args.username})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,90 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncFMC:
+    """
+    asyncio front end of the FMC class. It has the same GET/ADD/DELETE methods, but they are coroutines, so many
+    requests can be in flight at the same time. Each request runs in a worker thread on the FMC pooled Session, so
+    the rate limiter, the token refresh and the pagination of the FMC class are reused. At most `concurrency`
+    requests are sent at the same time, each one in a thread of its own pool (the default executor of asyncio has
+    at most min(32, CPUs + 4) threads). The pool_size of the FMC object should be at least the concurrency.
+    """
+
+    def __init__(self, fmc, concurrency=8):
+        self.__fmc = fmc
+        self.__concurrency = concurrency
+        self.__semaphore = None
+        self.__executor = ThreadPoolExecutor(
+            max_workers=max(1, concurrency), thread_name_prefix="AsyncFMC"
+        )
+
+    @property
+    def fmc(self):
+        return self.__fmc
+
+    @property
+    def ipaddr(self):
+        return self.__fmc.ipaddr
+
+    @property
+    def domain(self):
+        return self.__fmc.domain
+
+    @property
+    def concurrency(self):
+        return self.__concurrency
+
+    async def run(self, function, *args):
+        """
+        This method runs a blocking function (usually one of the get_*/add_* helpers) in a worker thread, respecting
+        the concurrency limit
+        :param function: Function to be called
+        :return: Return of the function
+        """
+        # The semaphore is created in the running event loop
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.__concurrency)
+        async with self.__semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.__executor, function, *args
+            )
+
+    #################################################################################################
+    # CONNECTION
+    #################################################################################################
+    async def connect(self, domain_name=None):
+        """
+        This method generates the tokens and selects the domain without asking the user
+        :param domain_name: Name of the domain. If None, the first domain returned by FMC is used
+        :return: List of domains returned by FMC
+        """
+        domain_list = await self.run(self.__fmc.token_manager.authenticate)
+        domain_uuid = domain_list[0]["uuid"]
+        for domain in domain_list:
+            if domain["name"] == domain_name:
+                domain_uuid = domain["uuid"]
+        self.__fmc.domain = domain_uuid
+        return domain_list
+
+    #################################################################################################
+    # GET / ADD / DELETE
+    #################################################################################################
+    async def request(self, method, path, json_data=None):
+        return await self.run(self.__fmc.request, method, path, json_data)
+
+    async def get_information(self, path, retorno_json_chave):
+        return await self.run(self.__fmc.get_information, path, retorno_json_chave)
+
+    async def add_information(self, path, json_data, retorno_json_chave):
+        return await self.run(
+            self.__fmc.add_information, path, json_data, retorno_json_chave
+        )
+
+    async def add_bulk_information(self, path, json_data, retorno_json_chave):
+        return await self.run(
+            self.__fmc.add_bulk_information, path, json_data, retorno_json_chave
+        )
+
+    async def delete_information(self, id, path):
+        return await self.run(self.__fmc.delete_information, id, path)
@@ -1,24 +1,61 @@
+import copy
 import json
-from urllib import response
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit
 
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
 from rich import print as rprint
 
 urllib3.disable_warnings()
-from ext.service.connection import refresh_token, validade_token
+from ext.service.connection import validade_token
+from ext.service.metrics import ApiMetrics
+from ext.service.rate_limit import RateLimiter
+from ext.service.token_manager import TokenManager
+
+# Number of times a request is sent again after FMC answers 429 (Too Many Requests)
+MAX_RETRIES = 5
+# Seconds to wait after a 429 when FMC does not send the Retry-After header
+DEFAULT_RETRY_AFTER = 10
 
 
 class FMC:
     def __init__(
-        self, ipaddr, username, password, domain="", authtoken="", refreshtoken=""
+        self,
+        ipaddr,
+        username,
+        password,
+        domain="",
+        authtoken="",
+        refreshtoken="",
+        pool_size=10,
+        rate_limit=120,
+        page_workers=4,
     ):
         self.__ipaddr = ipaddr
         self.__username = username
         self.__password = password
         self.__domain = domain
-        self.__authtoken = authtoken
-        self.__refreshtoken = refreshtoken
+        # Every request to this FMC goes through the same Session, so the TCP/TLS connections are kept alive and
+        # reused. pool_size is the number of connections kept open, which should match the number of parallel workers
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.__session.mount("https://", adapter)
+        self.__session.verify = False
+        self.__session.headers.update({"Content-Type": "application/json"})
+        # Every request waits for a slot in this window, so we never send more than rate_limit requests per minute
+        self.__rate_limiter = RateLimiter(rate_limit)
+        # Number of pages of a paginated GET fetched in parallel
+        self.__page_workers = page_workers
+        # Every request is recorded here (endpoint, status, latency, size), to find where the time is spent
+        self.__metrics = ApiMetrics()
+        # Refreshes the token before it expires, so requests are not rejected in the middle of a long run
+        self.__token_manager = TokenManager(self)
+        # The tokens are kept only in the Session headers, so copies made by for_domain always use the current token
+        self.authtoken = authtoken
+        self.refreshtoken = refreshtoken
 
     @property
     def ipaddr(self):
@@ -42,19 +79,113 @@ class FMC:
 
     @property
     def authtoken(self):
-        return self.__authtoken
+        return self.__session.headers.get("X-auth-access-token")
 
     @authtoken.setter
     def authtoken(self, value):
-        self.__authtoken = value
+        self.__session.headers.update({"X-auth-access-token": value})
 
     @property
     def refreshtoken(self):
-        return self.__refreshtoken
+        return self.__session.headers.get("X-auth-refresh-token")
 
     @refreshtoken.setter
     def refreshtoken(self, value):
-        self.__refreshtoken = value
+        self.__session.headers.update({"X-auth-refresh-token": value})
+
+    @property
+    def session(self):
+        return self.__session
+
+    @property
+    def rate_limiter(self):
+        return self.__rate_limiter
+
+    @property
+    def token_manager(self):
+        return self.__token_manager
+
+    @property
+    def metrics(self):
+        return self.__metrics
+
+    def for_domain(self, domain):
+        """
+        This method returns a FMC object for another domain of the same FMC. It shares the Session, the token, the
+        rate limiter and the metrics with this one, so many domains can be configured in parallel with one login
+        and one request budget.
+        :param domain: Domain UUID
+        :return: FMC
+        """
+        fmc = copy.copy(self)
+        fmc.domain = domain
+        return fmc
+
+    #################################################################################################
+    # REQUEST
+    #################################################################################################
+    def send(self, method, url, **kwargs):
+        """
+        This method sends any request to FMC using the pooled Session. The request waits for the rate limiter and,
+        if FMC answers 429, it waits for the Retry-After time and is sent again. Every request is recorded in the
+        metrics.
+        :param method: GET, POST, PUT or DELETE
+        :param url: Full URL
+        :return: Response
+        """
+        # verify is also passed on each request, otherwise REQUESTS_CA_BUNDLE would override the Session setting
+        kwargs.setdefault("verify", False)
+        latency = 0.0
+        for retry in range(MAX_RETRIES + 1):
+            self.__rate_limiter.acquire()
+            start = time.perf_counter()
+            r = self.__session.request(method, url, **kwargs)
+            latency += time.perf_counter() - start
+            if r.status_code != 429 or retry == MAX_RETRIES:
+                self.__metrics.record(
+                    method, url, r.status_code, latency, len(r.content), retry
+                )
+                return r
+            try:
+                retry_after = float(r.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+            except ValueError:
+                retry_after = DEFAULT_RETRY_AFTER
+            rprint(
+                f"[yellow]FMC rate limit reached. Waiting {retry_after} seconds . . .[/yellow]"
+            )
+            r.close()
+            self.__rate_limiter.pause(retry_after)
+
+    def request(self, method, path, json_data=None):
+        """
+        This method sends a request to the FMC config API using the pooled Session. The auth headers are shared by
+        every request of the Session. The token is renewed before it expires and, if FMC still says it is not valid,
+        it is renewed and the request is sent again.
+        :param method: GET, POST, PUT or DELETE
+        :param path: API Path, after /api/fmc_config/v1/domain/<DOMAIN_UUID>/
+        :param json_data: JSON Data to be sent in the body
+        :return: Response
+        """
+        api_path = f"/api/fmc_config/v1/domain/{self.domain}/{path}"
+        url = "https://" + self.ipaddr + api_path
+        kwargs = {}
+        if json_data is not None:
+            kwargs["data"] = json.dumps(json_data)
+
+        self.__token_manager.ensure_valid()
+        auth_token = self.authtoken
+        r = self.send(method, url, **kwargs)
+        if r.status_code == 401:
+            try:
+                is_token_valid = validade_token(json.loads(r.text))
+            except ValueError:
+                is_token_valid = True
+            if not is_token_valid:
+                r.close()
+                self.__metrics.record_token("invalid")
+                self.__token_manager.invalidate(auth_token)
+                r = self.send(method, url, **kwargs)
+        return r
 
     #################################################################################################
     # GET
@@ -74,100 +205,88 @@ class FMC:
             response_data = []
         else:
             response_data = {}
-        headers = {
-            "Content-Type": "application/json",
-            "X-auth-access-token": self.authtoken,
-            "X-auth-refresh-token": self.refreshtoken,
-        }
-        api_path = f"/api/fmc_config/v1/domain/{self.domain}/{path}"
-        url = "https://" + self.ipaddr + api_path
-
         try:
             # Send GET to FMC. FMC paginates the return in 1000 occurrences
-            r = requests.get(url, headers=headers, verify=False)
-            json_resp = json.loads(r.text)
-            # Check the response to see if the token was valid
-            is_token_valid = validade_token(json_resp)
-            if not is_token_valid:
-                # If it was not valid, refresh it and run again (recursive call)
-                self.authtoken, self.refreshtoken = refresh_token(
-                    self.authtoken, self.refreshtoken
-                )
-                response_data.update(self.get_information(path, retorno_json_chave))
-                return response_data
-
-            # For each element in the return of the GET...
-            try:
-                for element in json_resp["items"]:
-                    # Build the JSON to be returned, using the retorno_json_chave as Key
-                    # If the key is "all", return the full JSON and append this to a list
-                    if retorno_json_chave[0] == "all":
-                        response_data.append(element)
-                    # If the array has only one key, it is used. Some GETs uses "name", others use "values"
-                    elif len(retorno_json_chave) == 1:
-                        response_data.update(
-                            {element[retorno_json_chave[0]]: element["id"]}
-                        )
-                    # Is some special cases such as Ports, we return as <PORTNUMBER>/<PROTOCOL>, ex: 443/TCP.
-                    elif retorno_json_chave[0] == "port":
-                        try:
-                            response_data.update(
-                                {
-                                    f"{element['port']}/{element['protocol']}": element[
-                                        "id"
-                                    ]
-                                }
-                            )
-                        except KeyError:
-                            pass
-                    # Cases such as routes, we return the host and gateway
-                    elif retorno_json_chave[0] == "selectedNetworks":
-                        try:
-                            response_data.update(
-                                {
-                                    f"{element['interfaceName']}: {element['selectedNetworks'][0]['name']} --> {element['gateway']['literal']['value']}": element[
-                                        "id"
-                                    ]
-                                }
-                            )
-                        except:
-                            pass
-            except:
-                pass
-                # response_data.update({retorno_json_chave[0]: "Not Found"})
+            json_resp = self.__get_page(path)
+            self.__parse_items(json_resp, retorno_json_chave, response_data)
 
             # Pagination check
-            # If there are more than 1000 occurrences, FMC returns the next pages URL. So we need to place a new
-            # GET to each of those.
-            if (json_resp["paging"]["pages"]) > 1:
-                try:
-                    # Recursive call for each next page
-                    for page in json_resp["paging"]["next"]:
-                        # Set next_path variable so we can call the same function recursively.
-                        next_path = page.replace(
-                            f"https://{self.ipaddr}/api/fmc_config/v1/domain/{self.domain}/",
-                            "",
-                        )
-                        next_page_data = self.get_information(
-                            next_path, retorno_json_chave
-                        )
-                        if retorno_json_chave[0] == "all":
-                            for item in next_page_data:
-                                response_data.append(item)
-                        else:
-                            response_data.update(next_page_data)
+            # If there are more occurrences than the page limit, we use the count and limit of the first page to
+            # build the path of every remaining page and GET them in parallel. The pages are merged in order.
+            paging = json_resp.get("paging", {})
+            if paging.get("pages", 0) > 1:
+                next_paths = [
+                    self.__page_path(path, offset, paging["limit"])
+                    for offset in range(paging["limit"], paging["count"], paging["limit"])
+                ]
+                with ThreadPoolExecutor(max_workers=self.__page_workers) as executor:
+                    for next_page in executor.map(self.__get_page, next_paths):
+                        self.__parse_items(next_page, retorno_json_chave, response_data)
 
-                except KeyError:
-                    # End of next pages
-                    pass
-
-        except requests.exceptions.HTTPError as err:
+        except requests.exceptions.RequestException as err:
             print("Error in connection --> " + str(err))
-        finally:
-            if r:
-                r.close()
         return response_data
 
+    def __get_page(self, path):
+        # GET a single page and return its JSON
+        r = self.request("GET", path)
+        try:
+            return json.loads(r.text)
+        finally:
+            r.close()
+
+    def __page_path(self, path, offset, limit):
+        # Replace the offset and limit in the query of the path
+        url = urlsplit(path)
+        query = [
+            (key, value)
+            for key, value in parse_qsl(url.query)
+            if key not in ("offset", "limit")
+        ]
+        query += [("offset", offset), ("limit", limit)]
+        return f"{url.path}?{urlencode(query)}"
+
+    def __parse_items(self, json_resp, retorno_json_chave, response_data):
+        # For each element in the return of the GET...
+        try:
+            for element in json_resp["items"]:
+                # Build the JSON to be returned, using the retorno_json_chave as Key
+                # If the key is "all", return the full JSON and append this to a list
+                if retorno_json_chave[0] == "all":
+                    response_data.append(element)
+                # If the array has only one key, it is used. Some GETs uses "name", others use "values"
+                elif len(retorno_json_chave) == 1:
+                    response_data.update(
+                        {element[retorno_json_chave[0]]: element["id"]}
+                    )
+                # Is some special cases such as Ports, we return as <PORTNUMBER>/<PROTOCOL>, ex: 443/TCP.
+                elif retorno_json_chave[0] == "port":
+                    try:
+                        response_data.update(
+                            {
+                                f"{element['port']}/{element['protocol']}": element[
+                                    "id"
+                                ]
+                            }
+                        )
+                    except KeyError:
+                        pass
+                # Cases such as routes, we return the host and gateway
+                elif retorno_json_chave[0] == "selectedNetworks":
+                    try:
+                        response_data.update(
+                            {
+                                f"{element['interfaceName']}: {element['selectedNetworks'][0]['name']} --> {element['gateway']['literal']['value']}": element[
+                                    "id"
+                                ]
+                            }
+                        )
+                    except:
+                        pass
+        except:
+            pass
+            # response_data.update({retorno_json_chave[0]: "Not Found"})
+
     #################################################################################################
     # ADD
     #################################################################################################
@@ -181,30 +300,10 @@ class FMC:
         :return: JSON return with the entity created and ID
         """
         response_data = {}
-        headers = {
-            "Content-Type": "application/json",
-            "X-auth-access-token": self.authtoken,
-            "X-auth-refresh-token": self.refreshtoken,
-        }
-        api_path = f"/api/fmc_config/v1/domain/{self.domain}/{path}"
-        url = "https://" + self.ipaddr + api_path
-
         try:
-            r = requests.post(
-                url, data=json.dumps(json_data), headers=headers, verify=False
-            )
+            r = self.request("POST", path, json_data)
             json_resp = json.loads(r.text)
 
-            is_token_valid = validade_token(json_resp)
-            if not is_token_valid:
-                # If it was not valid, refresh it and run again (recursive call)
-                self.authtoken, self.refreshtoken = refresh_token(
-                    self.authtoken, self.refreshtoken
-                )
-                response_data = {}
-                # response_data.update(self.add_information(path, json_data, retorno_json_chave))
-                # return (response_data)
-
             # If success, we will return the object created and the ID
             if r.status_code == 200 or r.status_code == 201 or r.status_code == 202:
                 # If the return needs only one parameter (which is usually the case), we use this parameter
@@ -232,6 +331,52 @@ class FMC:
                 r.close()
         return response_data
 
+    def add_bulk_information(self, path, json_data, retorno_json_chave):
+        """
+        This is a generic bulk ADD method to send a list of elements in a single POST to FMC. The path must have bulk=true.
+        :param path: API Path
+        :param json_data: List of JSON Data
+        :param retorno_json_chave: Array of values to serve as Key in our JSON return
+        :return: created, response_data: created is True if FMC accepted the POST (2xx). response_data has the
+        entities created and IDs. If FMC rejects the POST, every element of the list will have the error message as value
+        """
+        response_data = {}
+        created = False
+        r = None
+        try:
+            r = self.request("POST", path, json_data)
+
+            # If success, FMC returns the elements created in the same order they were sent
+            if r.status_code == 200 or r.status_code == 201 or r.status_code == 202:
+                created = True
+                json_resp = json.loads(r.text)
+                for element in json_resp.get("items", []):
+                    response_data.update(
+                        {self.__element_key(element, retorno_json_chave): element["id"]}
+                    )
+            # If not, the whole list was rejected, so every element receives the error message
+            else:
+                for element in json_data:
+                    response_data.update(
+                        {self.__element_key(element, retorno_json_chave): r.text}
+                    )
+        # The body is not always JSON, ex: the error page of a proxy. The elements missing in response_data are
+        # handled by the caller
+        except ValueError as err:
+            print("Invalid answer from FMC --> " + str(err))
+        except requests.exceptions.RequestException as err:
+            print("Error in connection --> " + str(err))
+        finally:
+            if r:
+                r.close()
+        return created, response_data
+
+    def __element_key(self, element, retorno_json_chave):
+        # Ports are returned as <PORTNUMBER>/<PROTOCOL>, ex: 443/TCP. Other elements use the key itself.
+        if retorno_json_chave[0] == "port":
+            return f"{element['port']}/{element['protocol']}"
+        return element[retorno_json_chave[0]]
+
     #################################################################################################
     # DELETE
     #################################################################################################
@@ -243,26 +388,8 @@ class FMC:
         :param headers: Authentication Headers
         """
         response_data = {}
-        headers = {
-            "Content-Type": "application/json",
-            "X-auth-access-token": self.authtoken,
-            "X-auth-refresh-token": self.refreshtoken,
-        }
-        api_path = f"/api/fmc_config/v1/domain/{self.domain}/{path}"
-        url = "https://" + self.ipaddr + api_path
-
         try:
-            r = requests.delete(url, headers=headers, verify=False)
-            json_resp = json.loads(r.text)
-
-            is_token_valid = validade_token(json_resp)
-            if not is_token_valid:
-                # If it was not valid, refresh it and run again (recursive call)
-                self.authtoken, self.refreshtoken = refresh_token(
-                    self.authtoken, self.refreshtoken
-                )
-                response_data.update(self.delete_information(path, id, path))
-                return response_data
+            r = self.request("DELETE", path)
 
             # If success, we will return the object created and the ID
             if r.status_code == 200 or r.status_code == 201 or r.status_code == 202:
@@ -1,16 +1,21 @@
-import csv
 import json
-import re
 
 import requests
-from ext.service.fqdns import get_fqdn
-from ext.service.hosts import get_hosts
-from ext.service.networks import (get_host_network_id, get_network_groups,
-                                  get_networks)
-from ext.service.ports import add_ports, get_port_groups, get_ports
-from ext.service.security_zones import get_security_zones
+from ext.service.aggregate import aggregate_acps, merged_rows, report_merged
+from ext.service.auto_groups import (add_auto_network_group, add_auto_port_group,
+                                     network_group_name, port_group_name)
+from ext.service.catalog import ObjectCatalog
+from ext.service.csv_stream import TokenTable, read_acps, scan_tokens
+from ext.service.networks import (get_address_type, get_host_network_id,
+                                  network_literal, network_object_data)
+from ext.service.objects import add_network_objects_bulk
+from ext.service.ports import add_ports, add_ports_bulk, port_literal
+from ext.service.rule_index import DUPLICATED, RuleIndex
 from rich import print as rprint
 
+# Maximum number of elements accepted by FMC in a bulk POST
+BULK_LIMIT = 1000
+
 
 #################################################################################################
 # ACP
@@ -48,286 +53,723 @@ def add_acp_policy(fmc, post_data):
     return response_data
 
 
-def handle_network_list(fmc, networks, type, network_list, host_list, fqdn_list):
+def add_acp_rule(fmc, acp_policy_id, acp_category, post_data):
+    """
+    This method adds a single ACP Rule in a Category of an ACP Policy
+    :param post_data: JSON of the ACP Rule
+    :return: response_data: Rule name and ID, or Rule name and the error message
+    """
+    response_data = {}
+    path = f"policy/accesspolicies/{acp_policy_id}/accessrules?bulk=false&category={acp_category}"
+    r = None
+    try:
+        r = fmc.request("POST", path, post_data)
+        if r.status_code == 201 or r.status_code == 202:
+            json_resp = json.loads(r.text)
+            response_data.update({json_resp["name"]: json_resp["id"]})
+        else:
+            rprint(
+                f"[white]Error occurred in POST --> {json.dumps(r.text, sort_keys=True, indent=4, separators=(',', ': '))}[/white]".replace(
+                    "error", "[red]error[/red]]"
+                )
+            )
+            response_data.update({post_data["name"]: r.text})
+    except requests.exceptions.HTTPError as err:
+        print("Error in connection --> " + str(err))
+    finally:
+        if r:
+            r.close()
+    return response_data
+
+
+def add_acp_rules_bulk(fmc, acp_policy_id, acp_category, rules):
+    """
+    This method adds a list of ACP Rules in a Category of an ACP Policy with a single bulk POST.
+    FMC rejects the whole list if one of the rules is invalid. In this case, the rules are sent again one by one,
+    so each rule (and its CSV row) receives its own status.
+    :param rules: List of (CSV row number, JSON of the ACP Rule), in the CSV order
+    :return: response_data: Rule name and ID, or Rule name and the error message
+    """
+    path = f"policy/accesspolicies/{acp_policy_id}/accessrules?bulk=true&category={acp_category}"
+    retorno_json_chave = ["name"]
+    post_data = [rule for row, rule in rules]
+    created, status = fmc.add_bulk_information(path, post_data, retorno_json_chave)
+
+    response_data = {}
+    if created:
+        # The rules returned by FMC are matched to their rows by name
+        for row, rule in rules:
+            if rule["name"] in status:
+                response_data[rule["name"]] = status[rule["name"]]
+            else:
+                rprint(f"[red]Rule {rule['name']} (CSV line {row}) was not returned by FMC![/red]")
+                response_data[rule["name"]] = "Rule not returned by the bulk POST"
+        return response_data
+
+    rprint(
+        f"[yellow]Bulk POST of {len(rules)} rules in category {acp_category} failed. Adding them one by one . . .[/yellow]"
+    )
+    for row, rule in rules:
+        status = add_acp_rule(fmc, acp_policy_id, acp_category, rule)
+        # IDs never have spaces, while the error messages always do
+        if " " in status.get(rule["name"], " "):
+            rprint(f"[red]Rule {rule['name']} (CSV line {row}) was not added![/red]")
+        response_data.update(status)
+    return response_data
+
+
+def send_rules(fmc, catalog, acp_policy_id, acp_category, rules, bulk):
+    """
+    This method adds ACP Rules in a Category of an ACP Policy. The rules rejected by FMC because of an object ID
+    read from the inventory that FMC does not have anymore are sent again with the new IDs
+    :param catalog: ObjectCatalog of this run
+    :param rules: List of (CSV row number, JSON of the ACP Rule), in the CSV order
+    :param bulk: If True, the rules are sent in a single bulk POST. Otherwise, one POST per rule
+    :return: response_data: Rule name and ID, or Rule name and the error message
+    """
+    if bulk:
+        response_data = add_acp_rules_bulk(fmc, acp_policy_id, acp_category, rules)
+    else:
+        response_data = {}
+        for row, rule in rules:
+            response_data.update(add_acp_rule(fmc, acp_policy_id, acp_category, rule))
+    for row, rule in rules:
+        # IDs never have spaces, while the error messages always do
+        if " " in response_data.get(rule["name"], " ") and catalog.replace_stale_ids(rule):
+            rprint(f"[italic]Adding rule {rule['name']} again with the new IDs . . .[/italic]")
+            response_data.update(add_acp_rule(fmc, acp_policy_id, acp_category, rule))
+    return response_data
+
+
+def handle_network_list(fmc, networks, type, catalog, tokens=None):
     """
     This method is used by the add_acp method, and receives a list of network inputs from the CSV file, and generate
     the JSON structure for networks to be added in the ACP Rule
     :param networks: Network list from the CSV file. Each occurrence can be a Network, Host, FQDN or Group
     :param type: source or destination
-    :param network_list: network list from FMC
-    :param host_list: host list from FMC
-    :param fqdn_list: FQDN list frm FMC
+    :param catalog: ObjectCatalog with the networks, hosts, FQDNs and network groups from FMC
+    :param tokens: TokenTable with the type of each address already found. If None, the type is found again
     :return: JSON structure to be added in the POST to FMC when adding ACP
     """
     if type == "source":
         json_key = "sourceNetworks"
     elif type == "destination":
         json_key = "destinationNetworks"
+    # Long lists are replaced by a Network Group named by its content, so the networks are resolved only once
+    group_name = None
+    if catalog.group_threshold and len(set(networks)) >= catalog.group_threshold:
+        group_name = network_group_name(networks)
+        group_id = catalog.network_groups.get(group_name)
+        if group_id is not None:
+            return {json_key: {"objects": [{"type": "NetworkGroup", "id": group_id}]}}
     response_network_data = {json_key: {"objects": []}}
-    if networks[0] != "":
-        for network in networks:
-            # Check if the address has an IP format
-            isAddress = bool(re.match("^\d+.\d+.\d+.\d+", network))
-            # Check if the address is FQDN
-            isFQDN = bool(re.match(".*\..*", network))
-
-            # Network is a Network or Host
-            if isAddress or isFQDN:
+    object_lists = {
+        "Network": catalog.networks,
+        "Host": catalog.hosts,
+        "FQDN": catalog.fqdns,
+    }
+    for network in networks:
+        if network == "":
+            continue
+        if tokens is not None:
+            address_type = tokens.address_type(network)
+        else:
+            address_type = get_address_type(network)
+
+        # Network is a Network, Host or FQDN
+        if address_type in object_lists:
+            network_id = object_lists[address_type].get(network)
+            network_type = address_type
+            # The same prefix may exist written in another way (ex: 10.1.1.1/32 and the Host 10.1.1.1)
+            if network_id is None and address_type != "FQDN":
+                existing = catalog.find_network(network)
+                if existing is not None:
+                    network_id, network_type = existing
+            # In literal mode, the address is written in the rule instead of creating an object
+            if network_id is None and address_type in catalog.literals:
+                response_network_data[json_key].setdefault("literals", []).append(
+                    network_literal(network, address_type)
+                )
+                continue
+            if network_id is None:
                 network_id, network_type = get_host_network_id(
-                    fmc, network, network_list, host_list, fqdn_list
+                    fmc, network, catalog.networks, catalog.hosts, catalog.fqdns
                 )
-                network_data = {"type": network_type, "id": network_id}
+            network_data = {"type": network_type, "id": network_id}
+            response_network_data[json_key]["objects"].append(network_data)
+        # Network is a Group
+        else:
+            # The group list is downloaded once and only downloaded again if the group is not found
+            group_id = catalog.lookup("networkgroups", network)
+            if group_id is not None:
+                network_data = {
+                    "type": "NetworkGroup",
+                    "id": group_id,
+                }
                 response_network_data[json_key]["objects"].append(network_data)
-            # Network is a Group
             else:
-                try:
-                    group_list = get_network_groups(fmc)
-                    network_data = {
-                        "type": "NetworkGroup",
-                        "id": group_list[network],
-                    }
-                    response_network_data[json_key]["objects"].append(network_data)
-                except KeyError:
-                    rprint(
-                        "[red]Network group does not exist! Please create this network group and modify this rule manually![/red]"
-                    )
+                rprint(
+                    "[red]Network group does not exist! Please create this network group and modify this rule manually![/red]"
+                )
+    # The group is created only if every network was found
+    network_data = response_network_data[json_key]
+    if group_name is not None and len(network_data["objects"]) + len(
+        network_data.get("literals", [])
+    ) == len(networks):
+        group_id = add_auto_network_group(fmc, catalog, group_name, network_data)
+        if group_id is not None:
+            return {json_key: {"objects": [{"type": "NetworkGroup", "id": group_id}]}}
     return response_network_data
 
 
-def handle_port_list(fmc, ports, type, port_list):
+def handle_port_list(fmc, ports, type, catalog):
     """
     This method is used by the add_acp method, and receives a list of ports inputs from the CSV file, and generate
     the JSON structure for ports to be added in the ACP Rule
+    :param catalog: ObjectCatalog with the ports and port groups from FMC
     :return: JSON structure to be added in the POST to FMC when adding ACP
     """
     if type == "source":
         json_key = "sourcePorts"
     elif type == "destination":
         json_key = "destinationPorts"
+    # Long lists are replaced by a Port Group named by its content, so the ports are resolved only once
+    group_name = None
+    if catalog.group_threshold and len(set(ports)) >= catalog.group_threshold:
+        group_name = port_group_name(ports)
+        group_id = catalog.port_groups.get(group_name)
+        if group_id is not None:
+            return {json_key: {"objects": [{"type": "PortObjectGroup", "id": group_id}]}}
     response_port_data = {json_key: {"objects": []}}
 
-    if ports[0] != "":
+    port_list = catalog.ports
+    if ports and ports[0] != "":
         for port in ports:
             # If the port has a "/", it is in Port/Protocol format
             if "/" in port:
+                # In literal mode, the port is written in the rule instead of creating an object
+                if port not in port_list and "Port" in catalog.literals:
+                    response_port_data[json_key].setdefault("literals", []).append(
+                        port_literal(port)
+                    )
+                    continue
                 try:
                     port_id = port_list[port]
                 except KeyError:
-                    status_port = add_ports(fmc, port.split("/")[0], port.split("/")[1])
                     rprint(
                         f"[italic]Port {port} does not exist and will be created[/italic]"
                     )
+                    # The catalog is trusted and updated with the new port, so the next rules will reuse it
+                    status_port = add_ports(
+                        fmc, port.split("/")[0], port.split("/")[1], port_list
+                    )
                     port_id = status_port[port]
                 port_data = {"type": "ProtocolPortObject", "id": port_id}
                 response_port_data[json_key]["objects"].append(port_data)
             # Otherwise, it is a port group
             else:
-                port_group_list = get_port_groups(fmc)
-                try:
+                # The group list is downloaded once and only downloaded again if the group is not found
+                port_group_id = catalog.lookup("portgroups", port)
+                if port_group_id is not None:
                     port_group_data = {
                         "type": "PortObjectGroup",
-                        "id": port_group_list[port],
+                        "id": port_group_id,
                     }
                     response_port_data[json_key]["objects"].append(port_group_data)
-                except KeyError:
+                else:
                     rprint(
                         "[red]Port group does not exist! Please create this port group and modify this rule manually![/red]"
                     )
+    # The group is created only if every port was found. Port Groups do not accept literals
+    port_data = response_port_data[json_key]
+    if (
+        group_name is not None
+        and "literals" not in port_data
+        and len(port_data["objects"]) == len(ports)
+    ):
+        group_id = add_auto_port_group(fmc, catalog, group_name, port_data)
+        if group_id is not None:
+            return {json_key: {"objects": [{"type": "PortObjectGroup", "id": group_id}]}}
     return response_port_data
 
 
-def add_acp(fmc, csv_input):
+def add_missing_objects(fmc, csv_input, catalog, row_filter=None, tokens=None):
     """
-    This method adds ACPs listed in a CSV File
+    This method scans the whole CSV file before any rule is built and creates every Host, Network, FQDN and Port
+    that does not exist in FMC yet, using bulk POSTs. The catalog is updated with the IDs of the objects created.
     :param csv_input: CSV File
-    :return: response_data: Array with the Policies and IDs
+    :param catalog: ObjectCatalog of this run
+    :param row_filter: Function that receives a CSV line and returns False if it must be skipped
+    :param tokens: TokenTable already filled with every line of the CSV file. If None, the file is scanned
+    :return: response_data: Value and ID of each object created, or Value and the error message
     """
-    rprint("[italic]Colecting Security Zones List . . . [/italic]")
-    sec_zones_list = get_security_zones(fmc)  # Security Zones
-    rprint("[italic]Colecting ACPs List . . . [/italic]")
-    acp_policies_list = get_acp_policies(fmc)  # ACP Policies
+    # Each network and port is classified once, even if it is used by many lines
+    if tokens is None:
+        tokens = scan_tokens(csv_input, row_filter)
+    # Missing objects by type, in the CSV order
+    missing_objects = {}
+    object_lists = {
+        "Network": catalog.networks,
+        "Host": catalog.hosts,
+        "FQDN": catalog.fqdns,
+    }
+    catalog_kinds = {"Network": "networks", "Host": "hosts", "FQDN": "fqdns"}
+    for address_type, object_list in object_lists.items():
+        # The types written as literals do not need objects
+        if address_type in catalog.literals:
+            continue
+        missing_objects[address_type] = {
+            address: network_object_data(address, address_type)
+            for address in tokens.networks(address_type)
+            if address not in object_list
+            and (address_type == "FQDN" or catalog.find_network(address) is None)
+        }
+    missing_ports = {}
+    if "Port" not in catalog.literals:
+        missing_ports = {
+            port: True for port in tokens.ports() if "/" in port and port not in catalog.ports
+        }
 
     response_data = {}
-    with open(csv_input, "r") as input_file:
-        input_csv = csv.reader(input_file, delimiter=",")
-        for acp in input_csv:
-            # Skip header line and comments
-            if acp[0].startswith("#"):
-                continue
-            rprint(f"[italic]Adding rule {acp[1]} . . .[/italic]")
-            network_list = get_networks(fmc)  # Networks Objects
-            host_list = get_hosts(fmc)  # Host Objects
-            fqdn_list = get_fqdn(fmc)  # FQDN Objects
-            port_list = get_ports(fmc)  # Ports Objects
-
-            # Check if the Policy exists.
-            try:
-                acp_policy_id = acp_policies_list[acp[0]]
-            # If it doesn't exist, create it!
-            except:
-                acp_policy = {
-                    "type": "AccessPolicy",
-                    "name": acp[0],
-                    "defaultAction": {"action": "BLOCK"},
-                }
-                acp_policy_created = add_acp_policy(fmc, acp_policy)
-                acp_policy_id = acp_policy_created[acp[0]]
-                acp_policies_list = get_acp_policies(fmc)  # Update ACP Policies
-
-            # Check if Category exists.
-            try:
-                acp_categories = get_category(fmc, acp_policy_id)
-            except:
-                acp_categories = {}
-            try:
-                category_id = acp_categories[acp[2]]
-            except:
-                category_data = {"type": "Category", "name": acp[2]}
-                add_category(fmc, category_data, acp_policy_id)
-            finally:
-                acp_category = acp[2]
-
-            acp_rule_name = acp[1]
-            acp_action = acp[3]
-            source_interface = acp[4]
-            destination_interface = acp[5]
-            # Getting the list of networks and hosts. If there are more than one, they are splited with a ; in the
-            # CSV file
-            try:
-                source_network = acp[6].split(";")
-            except:
-                source_network = [acp[6]]
-            try:
-                destination_network = acp[7].split(";")
-            except:
-                destination_network = [acp[7]]
-
-            # Getting the list of ports. If there are more than one, they are splited with a ; in the CSV file
-            try:
-                source_ports = acp[8].split(";")
-            except:
-                source_ports = [acp[8]]
-            try:
-                destination_ports = acp[9].split(";")
-            except:
-                destination_ports = [acp[9]]
-
-            # Building the list of Source Networks in JSON Format.
-            data_source = handle_network_list(
-                fmc, source_network, "source", network_list, host_list, fqdn_list
-            )
-            # Building the íist of Destination Networks in JSON Format.
-            data_destination = handle_network_list(
-                fmc,
-                destination_network,
-                "destination",
-                network_list,
-                host_list,
-                fqdn_list,
-            )
-            # Handling cases where source and destination are the same
-            if "already exists" in json.dumps(data_destination):
-                data_destination = data_source
-
-            # Building the list of Source Ports
-            data_port_source = handle_port_list(fmc, source_ports, "source", port_list)
-            # Building the list of Destination Ports
-            data_port_destination = handle_port_list(
-                fmc, destination_ports, "destination", port_list
+    for address_type, objects in missing_objects.items():
+        if objects:
+            rprint(
+                f"[italic]Creating {len(objects)} {address_type} objects . . .[/italic]"
             )
+            status = add_network_objects_bulk(fmc, address_type, list(objects.values()))
+            for address, id in status.items():
+                if "error" not in id:
+                    catalog.add(catalog_kinds[address_type], address, id)
+            # If FMC says that objects we did not find already exist, our list is stale. Download it again
+            if "already exists" in json.dumps(status):
+                object_list = catalog.refresh(catalog_kinds[address_type])
+                for address in objects:
+                    if address in object_list:
+                        status[address] = object_list[address]
+            response_data.update(status)
+    if missing_ports:
+        rprint(f"[italic]Creating {len(missing_ports)} Port objects . . .[/italic]")
+        status = add_ports_bulk(fmc, list(missing_ports))
+        for port, id in status.items():
+            if "error" not in id:
+                catalog.add("ports", port, id)
+        if "already exists" in json.dumps(status):
+            port_list = catalog.refresh("ports")
+            for port in missing_ports:
+                if port in port_list:
+                    status[port] = port_list[port]
+        response_data.update(status)
+    return response_data
 
-            # Getting the Security Zones IDs. If it doesn't exist, abort!
-            if source_interface != "":
-                try:
-                    source_interface_id = sec_zones_list[source_interface]
-                    source_zone_list = {
-                        "sourceZones": {
-                            "objects": [
-                                {"id": source_interface_id, "type": "SecurityZone"}
-                            ]
-                        }
-                    }
-                except KeyError:
-                    rprint(
-                        f"[red]Security Zone {source_interface} does not exist. Aborting![/red]"
-                    )
-                    source_interface_id = ""
 
-            if destination_interface != "":
-                try:
-                    destination_interface_id = sec_zones_list[destination_interface]
-                    destination_zone_list = {
-                        "destinationZones": {
-                            "objects": [
-                                {
-                                    "id": destination_interface_id,
-                                    "type": "SecurityZone",
-                                }
-                            ]
+def build_acp_rule(fmc, acp, catalog, sec_zones_list, tokens=None):
+    """
+    This method builds the JSON of an ACP Rule from a CSV line. Hosts, Networks, FQDNs and Ports that do not exist
+    are created and added to the catalog
+    :param acp: AcpRow of the CSV line
+    :param catalog: ObjectCatalog of this run
+    :param tokens: TokenTable where the line was read
+    :param sec_zones_list: Security Zones list from FMC
+    :return: post_data: JSON of the ACP Rule, or None if a Security Zone does not exist
+    """
+    acp_rule_name = acp.name
+    acp_action = acp.action
+    source_interface = acp.source_zone
+    destination_interface = acp.destination_zone
+    # Lists of networks and ports. They are empty when the column is empty (any)
+    source_network = acp.source_networks
+    destination_network = acp.destination_networks
+    source_ports = acp.source_ports
+    destination_ports = acp.destination_ports
+
+    # Building the list of Source Networks in JSON Format.
+    data_source = handle_network_list(fmc, source_network, "source", catalog, tokens)
+    # Building the íist of Destination Networks in JSON Format.
+    data_destination = handle_network_list(
+        fmc, destination_network, "destination", catalog, tokens
+    )
+    # Handling cases where source and destination are the same
+    if "already exists" in json.dumps(data_destination):
+        data_destination = data_source
+
+    # Building the list of Source Ports
+    data_port_source = handle_port_list(fmc, source_ports, "source", catalog)
+    # Building the list of Destination Ports
+    data_port_destination = handle_port_list(
+        fmc, destination_ports, "destination", catalog
+    )
+
+    # Getting the Security Zones IDs. If it doesn't exist, abort!
+    if source_interface != "":
+        try:
+            source_interface_id = sec_zones_list[source_interface]
+            source_zone_list = {
+                "sourceZones": {
+                    "objects": [
+                        {"id": source_interface_id, "type": "SecurityZone"}
+                    ]
+                }
+            }
+        except KeyError:
+            rprint(
+                f"[red]Security Zone {source_interface} does not exist. Aborting![/red]"
+            )
+            return None
+
+    if destination_interface != "":
+        try:
+            destination_interface_id = sec_zones_list[destination_interface]
+            destination_zone_list = {
+                "destinationZones": {
+                    "objects": [
+                        {
+                            "id": destination_interface_id,
+                            "type": "SecurityZone",
                         }
-                    }
-                except KeyError:
-                    rprint(
-                        f"[red]Security Zone {destination_interface} does not exist. Aborting![/red]"
-                    )
-                    destination_interface_id = ""
-
-            # Creating the JSON
-            post_data = {
-                "action": acp_action.upper(),
-                "enabled": True,
-                "type": "AccessRule",
-                "name": acp_rule_name,
-                "sendEventsToFMC": True,
-                "logFiles": False,
-                "logBegin": True,
-                "logEnd": False,
+                    ]
+                }
             }
-            # Appending the Source Zone JSON if a source zone was specified on the CSV
-            if source_interface != "":
-                post_data.update(source_zone_list)
-            # Appending the Destination Zone JSON if a destination zone was specified on the CSV
-            if destination_interface != "":
-                post_data.update(destination_zone_list)
-            # Appending the Source Ports JSON if ports were specified on the CSV
-            if source_ports[0] != "":
-                post_data.update(data_port_source)
-            # Appending the Destination Ports JSON if ports were specified on the CSV
-            if destination_ports[0] != "":
-                post_data.update(data_port_destination)
-            # Appending the Source Networks JSON if source networks were specified on the CSV
-            if source_network[0] != "":
-                post_data.update(data_source)
-            # Appending the Destination Networks JSON if destination networks were specified on the CSV
-            if destination_network[0] != "":
-                post_data.update(data_destination)
-
-            api_path = f"/api/fmc_config/v1/domain/{fmc.domain}/policy/accesspolicies/{acp_policy_id}/accessrules?bulk=false&category={acp_category}"
-            url = "https://" + fmc.ipaddr + api_path
-            headers = {
-                "Content-Type": "application/json",
-                "X-auth-access-token": fmc.authtoken,
-                "X-auth-refresh-token": fmc.refreshtoken,
+        except KeyError:
+            rprint(
+                f"[red]Security Zone {destination_interface} does not exist. Aborting![/red]"
+            )
+            return None
+
+    # Creating the JSON
+    post_data = {
+        "action": acp_action.upper(),
+        "enabled": True,
+        "type": "AccessRule",
+        "name": acp_rule_name,
+        "sendEventsToFMC": True,
+        "logFiles": False,
+        "logBegin": True,
+        "logEnd": False,
+    }
+    # Appending the Source Zone JSON if a source zone was specified on the CSV
+    if source_interface != "":
+        post_data.update(source_zone_list)
+    # Appending the Destination Zone JSON if a destination zone was specified on the CSV
+    if destination_interface != "":
+        post_data.update(destination_zone_list)
+    # Appending the Source Ports JSON if ports were specified on the CSV
+    if source_ports:
+        post_data.update(data_port_source)
+    # Appending the Destination Ports JSON if ports were specified on the CSV
+    if destination_ports:
+        post_data.update(data_port_destination)
+    # Appending the Source Networks JSON if source networks were specified on the CSV
+    if source_network:
+        post_data.update(data_source)
+    # Appending the Destination Networks JSON if destination networks were specified on the CSV
+    if destination_network:
+        post_data.update(data_destination)
+
+    return post_data
+
+
+def check_existing_rule(rule_index, acp_policy_id, post_data):
+    """
+    This method checks if a rule is already in the ACP Policy (or was already queued in this run), and indexes it
+    if it is not
+    :param rule_index: RuleIndex of this run
+    :param post_data: JSON of the ACP Rule
+    :return: None if the rule must be added. Otherwise, the status of the rule (existing ID or error message)
+    """
+    status = rule_index.check(acp_policy_id, post_data)
+    if status is None:
+        rule_index.add(acp_policy_id, post_data)
+    elif status.startswith(DUPLICATED):
+        # It gets the status of the first line once that one is sent
+        rprint(
+            f"[yellow]Rule {post_data['name']} repeats a line of the CSV file. Skipping . . .[/yellow]"
+        )
+    elif " " in status:
+        rprint(f"[red]Rule {post_data['name']} was not added: {status}![/red]")
+    else:
+        rprint(
+            f"[yellow]Rule {post_data['name']} already exists in FMC. Skipping . . .[/yellow]"
+        )
+    return status
+
+
+def creation_error(status, name):
+    """
+    This method checks the status of a POST of a Policy or Category. IDs never have spaces, while the error messages
+    always do
+    :param status: Return of add_information
+    :param name: Name of the Policy or Category
+    :return: The error message, or None if FMC created it
+    """
+    object_id = status.get(name)
+    if object_id is None:
+        return "No answer from FMC"
+    if " " in object_id:
+        return object_id
+    return None
+
+
+def resolve_policies(fmc, acps, catalog, journal=None, rule_index=None):
+    """
+    This method creates every ACP Policy and Category used by the CSV lines before any rule is built, so the rules
+    are added without any Policy or Category lookup. The Categories of each Policy are downloaded once and the
+    missing ones are created in the order they appear in the CSV file
+    :param acps: AcpRow of the CSV lines. Only the Policy and Category of each line are kept
+    :param catalog: ObjectCatalog of this run. It is updated with the new Policies
+    :param journal: Journal where the Categories are recorded
+    :param rule_index: RuleIndex of this run. The Policies created are marked as empty
+    :return: Dict with the (Policy, Category) that could not be created and the status of their lines
+    """
+    # Categories by Policy. Dicts are used to drop duplicates and keep the CSV order
+    policies = {}
+    for acp in acps:
+        policies.setdefault(acp.policy, {})[acp.category] = True
+
+    failed = {}
+    acp_policies_list = catalog.acp_policies
+    for policy_name, categories in policies.items():
+        # Check if the Policy exists. If it doesn't exist, create it!
+        if policy_name not in acp_policies_list:
+            rprint(f"[italic]Creating ACP Policy {policy_name} . . .[/italic]")
+            acp_policy = {
+                "type": "AccessPolicy",
+                "name": policy_name,
+                "defaultAction": {"action": "BLOCK"},
             }
-            try:
-                r = requests.post(
-                    url, data=json.dumps(post_data), headers=headers, verify=False
+            acp_policy_created = add_acp_policy(fmc, acp_policy)
+            error = creation_error(acp_policy_created, policy_name)
+            if error is not None:
+                rprint(f"[red]ACP Policy {policy_name} was not created: {error}[/red]")
+                for category in categories:
+                    failed[(policy_name, category)] = f"ACP Policy {policy_name} was not created"
+                continue
+            catalog.add("accesspolicies", policy_name, acp_policy_created[policy_name])
+            if rule_index is not None:
+                rule_index.new_policy(acp_policy_created[policy_name])
+        acp_policy_id = acp_policies_list[policy_name]
+
+        # Check if the Categories exist. The journal says which ones were already checked
+        if journal is not None and all(
+            journal.has_category(acp_policy_id, category) for category in categories
+        ):
+            continue
+        try:
+            acp_categories = get_category(fmc, acp_policy_id)
+        except:
+            acp_categories = {}
+        for category in categories:
+            if category not in acp_categories:
+                category_data = {"type": "Category", "name": category}
+                error = creation_error(
+                    add_category(fmc, category_data, acp_policy_id), category
                 )
-                if r.status_code == 201 or r.status_code == 202:
-                    json_resp = json.loads(r.text)
-                    response_data.update({json_resp["name"]: json_resp["id"]})
-                else:
-                    rprint(
-                        f"[white]Error occurred in POST --> {json.dumps(r.text, sort_keys=True, indent=4, separators=(',', ': '))}[/white]".replace(
-                            "error", "[red]error[/red]]"
-                        )
+                # The Category may exist if it was not downloaded
+                if error is not None and "already exists" not in error:
+                    rprint(f"[red]Category {category} was not created: {error}[/red]")
+                    failed[(policy_name, category)] = f"Category {category} was not created"
+                    continue
+            if journal is not None:
+                journal.record_category(acp_policy_id, category)
+    return failed
+
+
+def skip_recorded_acps(acps, journal, response_data):
+    """
+    This method skips the CSV lines already added by the interrupted run
+    :param acps: AcpRow of the CSV lines
+    :param response_data: Updated with the status of the lines skipped
+    :return: Generator of the AcpRow not added yet
+    """
+    for acp in acps:
+        rule_added = journal.get_rule(journal.row_hash(acp.fields))
+        if rule_added is not None:
+            response_data.update(rule_added)
+            continue
+        yield acp
+
+
+def get_row_hashes(journal, acp):
+    """
+    :return: Hash and name of the CSV lines of a rule (more than one if lines were joined by the rule aggregation)
+    """
+    return [(journal.row_hash(line.fields), line.name) for line in merged_rows(acp)]
+
+
+def record_rules(journal, rules, status):
+    """
+    This method records in the journal the rules that were added
+    :param rules: List of ((CSV line hash, CSV line name), JSON of the ACP Rule)
+    :param status: Rule name and ID, or Rule name and the error message
+    """
+    for (row_hash, line_name), post_data in rules:
+        id = status.get(post_data["name"])
+        if id is not None and "error" not in id:
+            journal.record_rule(row_hash, line_name, id)
+
+
+def add_acp(
+    fmc,
+    csv_input,
+    bulk_size=0,
+    bulk_objects=False,
+    inventory=None,
+    journal=None,
+    row_filter=None,
+    skip_existing=True,
+    network_match="exact",
+    literals=(),
+    group_threshold=0,
+    aggregate_rules=False,
+):
+    """
+    This method adds ACPs listed in a CSV File
+    :param csv_input: CSV File
+    :param bulk_size: If greater than 0, the rules are grouped by Policy and Category (keeping the CSV order) and sent
+    in bulk POSTs of up to bulk_size rules (FMC limit is 1000). Otherwise, one POST is sent per rule.
+    :param bulk_objects: If True, every missing Host, Network, FQDN and Port is created with bulk POSTs before the
+    rules are built
+    :param inventory: Inventory used to reuse the lists downloaded in previous runs
+    :param journal: Journal where the work done is recorded. If it was opened to resume a run, the lines already
+    added are skipped
+    :param row_filter: Function that receives a CSV line and returns False if it must be skipped (ex: the line is
+    for another domain)
+    :param skip_existing: If True, the rules already in the ACP Policies are downloaded and the CSV lines that
+    match them are skipped
+    :param network_match: How an address of the CSV file finds an existing Host or Network: "exact" (same prefix,
+    however it is written), "covering" (same prefix or, if there is none, the smallest Network that contains it) or
+    "string" (same text only)
+    :param literals: Types (Host, Network and Port) written as literals in the rules, instead of creating an
+    object, when there is no object for the value. FQDNs always need an object
+    :param group_threshold: If greater than 0, the lists of networks or ports with at least this number of values
+    are replaced by a Network Group or Port Group named by a hash of its values, created once and reused by the
+    next rules with the same list
+    :param aggregate_rules: If True, the CSV lines that can be a single rule without changing what the Policy does
+    are joined before they are sent (see aggregate_acps). Every line still gets the status of its rule
+    :return: response_data: Array with the Policies and IDs
+    """
+    bulk_size = min(bulk_size, BULK_LIMIT)
+    # Hashes of the CSV lines of each rule queued to be sent in bulk, to record them in the journal
+    row_hashes = {}
+    # Rules waiting to be sent in bulk, grouped by (ACP Policy ID, Category)
+    pending_rules = {}
+    # Security Zones, ACPs, Networks, Hosts, FQDNs and Ports are downloaded only once per run and updated as
+    # objects are created
+    catalog = ObjectCatalog(
+        fmc, inventory, journal, network_match, literals, group_threshold
+    )
+    sec_zones_list = catalog.security_zones  # Security Zones
+    acp_policies_list = catalog.acp_policies  # ACP Policies
+    # Rules of each ACP Policy, downloaded the first time the Policy is used
+    rule_index = RuleIndex(fmc) if skip_existing else None
+    # Networks and ports are interned and classified once, by the first pass that reads the CSV file
+    tokens = TokenTable()
+    if bulk_objects:
+        rprint("[italic]Creating missing objects . . .[/italic]")
+        add_missing_objects(
+            fmc, csv_input, catalog, row_filter, scan_tokens(csv_input, row_filter, tokens)
+        )
+    # Every Policy and Category is created before the rules, in the order they appear in the CSV file
+    rprint("[italic]Creating missing ACP Policies and Categories . . .[/italic]")
+    failed_policies = resolve_policies(
+        fmc, read_acps(csv_input, tokens, row_filter), catalog, journal, rule_index
+    )
+
+    response_data = {}
+    acps = read_acps(csv_input, tokens, row_filter)
+    # Skip the lines already added by the interrupted run
+    if journal is not None:
+        acps = skip_recorded_acps(acps, journal, response_data)
+    # The lines must be read before they are joined, so the aggregation keeps them in memory
+    if aggregate_rules:
+        acps = aggregate_acps(acps)
+    # Rule name -> names of the lines joined in the rule
+    merged_names = {}
+    for acp in acps:
+        row = acp.row
+        if acp.merged:
+            merged_names[acp.name] = [line.name for line in acp.merged]
+        if journal is not None:
+            lines = get_row_hashes(journal, acp)
+        rprint(f"[italic]Adding rule {acp.name} . . .[/italic]")
+
+        # The Policy and Category were created by resolve_policies, unless FMC refused them
+        if (acp.policy, acp.category) in failed_policies:
+            response_data.update({acp.name: failed_policies[(acp.policy, acp.category)]})
+            continue
+        acp_policy_id = acp_policies_list[acp.policy]
+        acp_category = acp.category
+
+        post_data = build_acp_rule(fmc, acp, catalog, sec_zones_list, tokens)
+        if post_data is None:
+            response_data.update({acp.name: "Security Zone does not exist"})
+            continue
+        if rule_index is not None:
+            existing_rule = check_existing_rule(rule_index, acp_policy_id, post_data)
+            if existing_rule is not None:
+                response_data.update({acp.name: existing_rule})
+                continue
+
+        if bulk_size > 0:
+            # Queue the rule and send the batch once it is full
+            batch = pending_rules.setdefault((acp_policy_id, acp_category), [])
+            batch.append((row, post_data))
+            if journal is not None:
+                row_hashes[row] = lines
+            if len(batch) >= bulk_size:
+                status = send_rules(
+                    fmc, catalog, acp_policy_id, acp_category, batch, bulk=True
+                )
+                if rule_index is not None:
+                    rule_index.update(acp_policy_id, [rule for row, rule in batch], status)
+                if journal is not None:
+                    record_rules(
+                        journal,
+                        [
+                            (line, rule)
+                            for row, rule in batch
+                            for line in row_hashes.pop(row)
+                        ],
+                        status,
                     )
-            except requests.exceptions.HTTPError as err:
-                print("Error in connection --> " + str(err))
-            finally:
-                if r:
-                    r.close()
+                response_data.update(status)
+                pending_rules[(acp_policy_id, acp_category)] = []
+        else:
+            status = send_rules(
+                fmc, catalog, acp_policy_id, acp_category, [(row, post_data)], bulk=False
+            )
+            if rule_index is not None:
+                rule_index.update(acp_policy_id, [post_data], status)
+            if journal is not None:
+                record_rules(
+                    journal, [(line, post_data) for line in lines], status
+                )
+            response_data.update(status)
+
+    # Send the remaining rules of each Policy and Category
+    for (acp_policy_id, acp_category), batch in pending_rules.items():
+        if batch:
+            rprint(
+                f"[italic]Adding {len(batch)} rules in category {acp_category} . . .[/italic]"
+            )
+            status = send_rules(
+                fmc, catalog, acp_policy_id, acp_category, batch, bulk=True
+            )
+            if rule_index is not None:
+                rule_index.update(acp_policy_id, [rule for row, rule in batch], status)
+            if journal is not None:
+                record_rules(
+                    journal,
+                    [
+                        (line, rule)
+                        for row, rule in batch
+                        for line in row_hashes.pop(row)
+                    ],
+                    status,
+                )
+            response_data.update(status)
 
+    report_merged(response_data, merged_names)
+    catalog.save()
     return response_data
 
 
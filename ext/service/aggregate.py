@@ -0,0 +1,114 @@
+from rich import print as rprint
+
+# Lists that can be joined. Two lines are joined only if every other column is the same
+MERGE_FIELDS = (
+    "destination_networks",
+    "source_networks",
+    "destination_ports",
+    "source_ports",
+)
+# Maximum number of values in a joined list, so the rules stay readable and far from the FMC limits
+MAX_MERGED_VALUES = 50
+
+
+#################################################################################################
+# RULE AGGREGATION
+#################################################################################################
+def merged_rows(acp):
+    """
+    :return: The CSV lines that were joined in a rule (only the line itself if it was not aggregated)
+    """
+    return acp.merged or (acp,)
+
+
+def _rule_key(acp, merge_field):
+    # Everything that must be the same to join two lines in merge_field. The order of the other lists does not
+    # change the traffic
+    key = [acp.source_zone, acp.destination_zone]
+    for field in MERGE_FIELDS:
+        if field != merge_field:
+            key.append(frozenset(getattr(acp, field)))
+    return tuple(key)
+
+
+def _merge(first, second, merge_field):
+    values = tuple(dict.fromkeys(getattr(first, merge_field) + getattr(second, merge_field)))
+    return first._replace(
+        merged=merged_rows(first) + merged_rows(second), **{merge_field: values}
+    )
+
+
+def _merge_segment(segment):
+    # Join the lines of a segment while any two of them differ in a single list. An empty list (any) is never
+    # joined, since the union with any is any and the other line would be lost in the report
+    changed = True
+    while changed:
+        changed = False
+        for merge_field in MERGE_FIELDS:
+            rules = {}
+            for acp in segment:
+                values = getattr(acp, merge_field)
+                key = _rule_key(acp, merge_field)
+                target = rules.get(key)
+                if (
+                    target is not None
+                    and values
+                    and getattr(target, merge_field)
+                    and len(set(getattr(target, merge_field) + values)) <= MAX_MERGED_VALUES
+                ):
+                    rules[key] = _merge(target, acp, merge_field)
+                    changed = True
+                elif target is None and values:
+                    rules[key] = acp
+                else:
+                    # Kept alone, with a key of its own
+                    rules[(key, acp.row)] = acp
+            segment = list(rules.values())
+    return segment
+
+
+def aggregate_acps(acps):
+    """
+    This method joins the CSV lines that can be a single rule without changing what the ACP Policy does: lines of
+    the same Policy, Category, action and zones that differ in only one list (source or destination networks or
+    ports) become one rule with the union of that list. A line is only moved up past lines with the same action
+    in the same Policy and Category, so the first rule matching any traffic still has the same action. The rules
+    keep the order of their first line, so the Categories are created in the same order.
+    :param acps: AcpRow of the CSV lines, in the CSV order
+    :return: List of AcpRow. A joined rule has the name of its first line, and its lines in `merged`
+    """
+    # Segments of lines of the same Policy and Category with the same action and no other line between them
+    segments = []
+    open_segments = {}
+    lines = 0
+    for acp in acps:
+        lines += 1
+        segment = open_segments.get((acp.policy, acp.category))
+        if segment is None or segment[0].action.upper() != acp.action.upper():
+            segment = []
+            segments.append(segment)
+            open_segments[(acp.policy, acp.category)] = segment
+        segment.append(acp)
+
+    rules = []
+    for segment in segments:
+        rules += _merge_segment(segment)
+    rules.sort(key=lambda acp: acp.row)
+    if lines:
+        rprint(
+            f"[italic]Rule aggregation: {lines} lines became {len(rules)} rules "
+            f"({1 - len(rules) / lines:.1%} fewer)[/italic]"
+        )
+    return rules
+
+
+def report_merged(response_data, merged_names):
+    """
+    This method copies the status of each joined rule to every line joined in it, so each CSV line has a status
+    :param response_data: Rule name and ID, or Rule name and the error message
+    :param merged_names: Rule name -> names of the lines joined in the rule
+    """
+    for name, member_names in merged_names.items():
+        if name in response_data:
+            for member_name in member_names:
+                response_data[member_name] = response_data[name]
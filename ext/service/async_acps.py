@@ -0,0 +1,335 @@
+import asyncio
+
+from ext.service.acps import (BULK_LIMIT, add_missing_objects, build_acp_rule,
+                              check_existing_rule, creation_error, get_category,
+                              get_row_hashes, record_rules, send_rules,
+                              skip_recorded_acps)
+from ext.service.aggregate import aggregate_acps, report_merged
+from ext.service.catalog import ObjectCatalog
+from ext.service.csv_stream import TokenTable, read_acps
+from ext.service.networks import get_host_network_id
+from ext.service.ports import add_ports
+from ext.service.rule_index import RuleIndex
+from rich import print as rprint
+
+
+#################################################################################################
+# ASYNC OBJECT RESOLVERS
+#################################################################################################
+async def get_host_network_id_async(afmc, address, catalog):
+    """
+    This method returns the ID and type of a host, network or FQDN, creating it if it does not exist
+    :return: id, address_type: ID and type of the host, network or fqdn in FMC
+    """
+    return await afmc.run(
+        get_host_network_id,
+        afmc.fmc,
+        address,
+        catalog.networks,
+        catalog.hosts,
+        catalog.fqdns,
+    )
+
+
+async def get_port_id_async(afmc, port, catalog):
+    """
+    This method returns the ID of a port in the format <PORTNUMBER>/<PROTOCOL>, creating it if it does not exist
+    :return: port_id: ID of the port in FMC
+    """
+    if port in catalog.ports:
+        return catalog.ports[port]
+    status_port = await afmc.run(
+        add_ports, afmc.fmc, port.split("/")[0], port.split("/")[1], catalog.ports
+    )
+    return status_port[port]
+
+
+async def resolve_objects_async(afmc, tokens, catalog):
+    """
+    This method creates, in parallel, every Host, Network, FQDN and Port used by the CSV lines that does not exist
+    in FMC yet. Each value is resolved only once, even if it is used by many lines.
+    :param tokens: TokenTable with the unique networks and ports of the CSV lines
+    :param catalog: ObjectCatalog of this run
+    """
+    object_lists = {
+        "Network": catalog.networks,
+        "Host": catalog.hosts,
+        "FQDN": catalog.fqdns,
+    }
+    # The types written as literals do not need objects
+    tasks = [
+        get_host_network_id_async(afmc, address, catalog)
+        for address_type, object_list in object_lists.items()
+        if address_type not in catalog.literals
+        for address in tokens.networks(address_type)
+        if address not in object_list
+        and (address_type == "FQDN" or catalog.find_network(address) is None)
+    ]
+    if "Port" not in catalog.literals:
+        tasks += [
+            get_port_id_async(afmc, port, catalog)
+            for port in tokens.ports()
+            if "/" in port and port not in catalog.ports
+        ]
+    if tasks:
+        rprint(f"[italic]Creating {len(tasks)} missing objects . . .[/italic]")
+        await asyncio.gather(*tasks)
+
+
+#################################################################################################
+# ASYNC ACP
+#################################################################################################
+async def resolve_policies_async(
+    afmc, acps, acp_policies_list, journal=None, rule_index=None
+):
+    """
+    This method creates the missing ACP Policies in parallel and, for each Policy, the missing Categories in the
+    order they appear in the CSV file
+    :param acps: List of AcpRow
+    :param acp_policies_list: Policy name and ID of every ACP Policy in FMC. It is updated with the new Policies
+    :param journal: Journal where the Categories are recorded
+    :param rule_index: RuleIndex of this run. The Policies created are marked as empty
+    :return: Dict with the (Policy, Category) that could not be created and the status of their lines
+    """
+    # Categories by Policy. Dicts are used to drop duplicates and keep the CSV order
+    policies = {}
+    for acp in acps:
+        policies.setdefault(acp.policy, {})[acp.category] = True
+    failed = {}
+
+    async def create_policy(policy_name):
+        acp_policy = {
+            "type": "AccessPolicy",
+            "name": policy_name,
+            "defaultAction": {"action": "BLOCK"},
+        }
+        status = await afmc.add_information(
+            "policy/accesspolicies", acp_policy, ["name"]
+        )
+        error = creation_error(status, policy_name)
+        if error is not None:
+            rprint(f"[red]ACP Policy {policy_name} was not created: {error}[/red]")
+            for category in policies[policy_name]:
+                failed[(policy_name, category)] = f"ACP Policy {policy_name} was not created"
+            return
+        acp_policies_list[policy_name] = status[policy_name]
+        if rule_index is not None:
+            rule_index.new_policy(status[policy_name])
+
+    async def create_categories(policy_name, categories):
+        if policy_name not in acp_policies_list:
+            return
+        acp_policy_id = acp_policies_list[policy_name]
+        if journal is not None and all(
+            journal.has_category(acp_policy_id, category) for category in categories
+        ):
+            return
+        existing = await afmc.run(get_category, afmc.fmc, acp_policy_id)
+        # Categories of the same Policy are created one by one, so they keep the CSV order
+        for category in categories:
+            if category not in existing:
+                status = await afmc.add_information(
+                    f"policy/accesspolicies/{acp_policy_id}/categories",
+                    {"type": "Category", "name": category},
+                    ["name"],
+                )
+                error = creation_error(status, category)
+                # The Category may exist if it was not downloaded
+                if error is not None and "already exists" not in error:
+                    rprint(f"[red]Category {category} was not created: {error}[/red]")
+                    failed[(policy_name, category)] = f"Category {category} was not created"
+                    continue
+            if journal is not None:
+                journal.record_category(acp_policy_id, category)
+
+    await asyncio.gather(
+        *[
+            create_policy(policy_name)
+            for policy_name in policies
+            if policy_name not in acp_policies_list
+        ]
+    )
+    await asyncio.gather(
+        *[
+            create_categories(policy_name, categories)
+            for policy_name, categories in policies.items()
+        ]
+    )
+    return failed
+
+
+async def add_acp_async(
+    afmc,
+    csv_input,
+    bulk_size=0,
+    bulk_objects=False,
+    inventory=None,
+    journal=None,
+    row_filter=None,
+    skip_existing=True,
+    network_match="exact",
+    literals=(),
+    group_threshold=0,
+    aggregate_rules=False,
+):
+    """
+    This method adds ACPs listed in a CSV File, like add_acp, but overlapping the requests: the lists are collected in
+    parallel, the missing objects are created in parallel and the rules of different Policies are sent in parallel.
+    The rules of the same Policy are always sent in the CSV order.
+    :param afmc: AsyncFMC
+    :param csv_input: CSV File
+    :param bulk_size: If greater than 0, the rules of each Category are sent in bulk POSTs of up to bulk_size rules
+    :param bulk_objects: If True, the missing objects are created with bulk POSTs instead of parallel single POSTs
+    :param inventory: Inventory used to reuse the lists downloaded in previous runs
+    :param journal: Journal where the work done is recorded. If it was opened to resume a run, the lines already
+    added are skipped
+    :param row_filter: Function that receives a CSV line and returns False if it must be skipped
+    :param skip_existing: If True, the CSV lines that match rules already in the ACP Policies are skipped
+    :param network_match: How an address finds an existing Host or Network: exact, covering or string
+    :param literals: Types (Host, Network and Port) written as literals in the rules instead of creating objects
+    :param group_threshold: If greater than 0, the lists with at least this number of values are replaced by groups
+    :param aggregate_rules: If True, the CSV lines that can be a single rule are joined before they are sent
+    :return: response_data: Array with the Policies and IDs
+    """
+    fmc = afmc.fmc
+    bulk_size = min(bulk_size, BULK_LIMIT)
+    catalog = ObjectCatalog(
+        fmc, inventory, journal, network_match, literals, group_threshold
+    )
+    rule_index = RuleIndex(fmc) if skip_existing else None
+
+    response_data = {}
+    # The lines are kept in memory to be sent in parallel, but the networks and ports repeated in many lines are
+    # stored once
+    tokens = TokenTable()
+    acps = read_acps(csv_input, tokens, row_filter)
+    # Skip the lines already added by the interrupted run
+    if journal is not None:
+        acps = skip_recorded_acps(acps, journal, response_data)
+    if aggregate_rules:
+        acps = aggregate_acps(acps)
+    acps = list(acps)
+    # Hashes of the CSV lines of each rule, to record them in the journal
+    row_hashes = {}
+    if journal is not None:
+        row_hashes = {acp.row: get_row_hashes(journal, acp) for acp in acps}
+    # Rule name -> names of the lines joined in the rule
+    merged_names = {
+        acp.name: [line.name for line in acp.merged] for acp in acps if acp.merged
+    }
+
+    rprint("[italic]Colecting Security Zones, ACPs and Objects Lists . . . [/italic]")
+    sec_zones_list, acp_policies_list, *_ = await asyncio.gather(
+        *[
+            afmc.run(catalog.get, kind)
+            for kind in (
+                "securityzones",
+                "accesspolicies",
+                "networks",
+                "hosts",
+                "fqdns",
+                "ports",
+                "networkgroups",
+                "portgroups",
+            )
+        ]
+    )
+
+    if bulk_objects:
+        # The tokens were already filled when the lines were read, so the file is not scanned again
+        resolve_objects = afmc.run(
+            add_missing_objects, fmc, csv_input, catalog, row_filter, tokens
+        )
+    else:
+        resolve_objects = resolve_objects_async(afmc, tokens, catalog)
+    failed_policies, _ = await asyncio.gather(
+        resolve_policies_async(afmc, acps, acp_policies_list, journal, rule_index),
+        resolve_objects,
+    )
+    # The lines of a Policy or Category that FMC refused are not built
+    for acp in acps:
+        if (acp.policy, acp.category) in failed_policies:
+            response_data.update({acp.name: failed_policies[(acp.policy, acp.category)]})
+    acps = [acp for acp in acps if (acp.policy, acp.category) not in failed_policies]
+
+    # Every object exists now, so building the rules does not create anything
+    post_data_list = await asyncio.gather(
+        *[
+            afmc.run(build_acp_rule, fmc, acp, catalog, sec_zones_list, tokens)
+            for acp in acps
+        ]
+    )
+
+    # The existing rules of every Policy are downloaded in parallel
+    if rule_index is not None:
+        await asyncio.gather(
+            *[
+                afmc.run(rule_index.load, acp_policy_id)
+                for acp_policy_id in {acp_policies_list[acp.policy] for acp in acps}
+            ]
+        )
+
+    # Rules grouped by ACP Policy ID and then by Category, keeping the CSV order
+    rule_groups = {}
+    for acp, post_data in zip(acps, post_data_list):
+        if post_data is None:
+            response_data.update({acp.name: "Security Zone does not exist"})
+            continue
+        acp_policy_id = acp_policies_list[acp.policy]
+        if rule_index is not None:
+            existing_rule = check_existing_rule(rule_index, acp_policy_id, post_data)
+            if existing_rule is not None:
+                response_data.update({acp.name: existing_rule})
+                continue
+        rule_groups.setdefault(acp_policy_id, {}).setdefault(acp.category, []).append(
+            (acp.row, post_data)
+        )
+
+    # FMC locks a Policy while it is changed, so the rules of the same Policy are sent one request at a time
+    async def add_rules(acp_policy_id, categories):
+        for acp_category, rules in categories.items():
+            rprint(
+                f"[italic]Adding {len(rules)} rules in category {acp_category} . . .[/italic]"
+            )
+            if bulk_size > 0:
+                batches = [
+                    rules[index : index + bulk_size]
+                    for index in range(0, len(rules), bulk_size)
+                ]
+            else:
+                batches = [[rule] for rule in rules]
+            for batch in batches:
+                status = await afmc.run(
+                    send_rules,
+                    fmc,
+                    catalog,
+                    acp_policy_id,
+                    acp_category,
+                    batch,
+                    bulk_size > 0,
+                )
+                if rule_index is not None:
+                    rule_index.update(
+                        acp_policy_id, [post_data for row, post_data in batch], status
+                    )
+                if journal is not None:
+                    record_rules(
+                        journal,
+                        [
+                            (line, post_data)
+                            for row, post_data in batch
+                            for line in row_hashes[row]
+                        ],
+                        status,
+                    )
+                response_data.update(status)
+
+    await asyncio.gather(
+        *[
+            add_rules(acp_policy_id, categories)
+            for acp_policy_id, categories in rule_groups.items()
+        ]
+    )
+    report_merged(response_data, merged_names)
+    catalog.save()
+    return response_data
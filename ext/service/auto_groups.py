@@ -0,0 +1,124 @@
+import hashlib
+import json
+import threading
+
+from ext.service.group_index import NetworkGroupIndex
+from rich import print as rprint
+
+# Only one worker creates each group. The others wait and reuse it
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+#################################################################################################
+# AUTO GROUPS
+#################################################################################################
+def auto_group_name(prefix, members):
+    """
+    This method returns the name of the group of a list of members. The name is a hash of the sorted members, so
+    the same list (in any order, with repeated values or written in another way) always has the same name, in any
+    run and in any FMC
+    :param prefix: auto_net or auto_port
+    :param members: Canonical members
+    """
+    content = json.dumps(sorted(set(members)))
+    return f"{prefix}_{hashlib.sha256(content.encode()).hexdigest()[:16]}"
+
+
+def network_group_name(networks):
+    """
+    This method returns the name of the Network Group of a list of networks of the CSV file
+    """
+    # The IP addresses are compared by prefix, so 10.1.1.1 and 10.1.1.1/32 are the same member
+    return auto_group_name(
+        "auto_net", [NetworkGroupIndex.literal_key(network) for network in networks]
+    )
+
+
+def port_group_name(ports):
+    """
+    This method returns the name of the Port Group of a list of ports of the CSV file
+    """
+    return auto_group_name("auto_port", [port.strip() for port in ports])
+
+
+def _group_lock(name):
+    with _locks_lock:
+        return _locks.setdefault(name, threading.Lock())
+
+
+def add_auto_network_group(fmc, catalog, group_name, network_data):
+    """
+    This method returns the Network Group that has exactly the networks of a rule, creating it if it does not exist.
+    An existing group with the same members and another name is reused
+    :param catalog: ObjectCatalog of this run
+    :param group_name: Name from network_group_name
+    :param network_data: Objects and literals of the networks, as built for the rule
+    :return: ID of the Network Group, or None if it was not created
+    """
+    objects = network_data.get("objects", [])
+    literals = network_data.get("literals", [])
+    with _group_lock(group_name):
+        group_id = catalog.network_groups.get(group_name)
+        if group_id is not None:
+            return group_id
+
+        group_index = catalog.group_index
+        members = set()
+        for element in objects + literals:
+            if element.get("type") == "NetworkGroup":
+                members |= group_index.members(element["id"])
+            else:
+                members.add(group_index.member_key(element))
+        group_id = group_index.find_group(members)
+        if group_id is not None:
+            rprint(f"[italic]Reusing the Network Group with the same networks of {group_name}[/italic]")
+            catalog.add("networkgroups", group_name, group_id)
+            return group_id
+
+        rprint(f"[italic]Creating Network Group {group_name} with {len(members)} networks . . .[/italic]")
+        post_data = {"name": group_name, "type": "NetworkGroup", "objects": objects}
+        if literals:
+            post_data["literals"] = literals
+        status = fmc.add_information("object/networkgroups", post_data, ["name"])
+        group_id = status.get(group_name)
+        # Created by another run after the list was downloaded. Its name says it has the same networks
+        if group_id is not None and "already exists" in group_id:
+            group_id = catalog.lookup("networkgroups", group_name)
+        if group_id is None or "error" in group_id:
+            rprint(f"[red]Network Group {group_name} was not created. Using the networks in the rule[/red]")
+            return None
+        if group_name not in catalog.network_groups:
+            catalog.add("networkgroups", group_name, group_id)
+            group_index.add(dict(post_data, id=group_id))
+        return group_id
+
+
+def add_auto_port_group(fmc, catalog, group_name, port_data):
+    """
+    This method returns the Port Group that has exactly the ports of a rule, creating it if it does not exist
+    :param group_name: Name from port_group_name
+    :param port_data: Objects of the ports, as built for the rule. Port Groups do not accept literals
+    :return: ID of the Port Group, or None if it was not created
+    """
+    with _group_lock(group_name):
+        group_id = catalog.port_groups.get(group_name)
+        if group_id is not None:
+            return group_id
+
+        rprint(f"[italic]Creating Port Group {group_name} with {len(port_data['objects'])} ports . . .[/italic]")
+        post_data = {
+            "name": group_name,
+            "type": "PortObjectGroup",
+            "objects": port_data["objects"],
+        }
+        status = fmc.add_information("object/portobjectgroups", post_data, ["name"])
+        group_id = status.get(group_name)
+        if group_id is not None and "already exists" in group_id:
+            group_id = catalog.lookup("portgroups", group_name)
+        if group_id is None or "error" in group_id:
+            rprint(f"[red]Port Group {group_name} was not created. Using the ports in the rule[/red]")
+            return None
+        if group_name not in catalog.port_groups:
+            catalog.add("portgroups", group_name, group_id)
+        return group_id
@@ -0,0 +1,358 @@
+import threading
+
+from ext.service.fqdns import get_fqdn
+from ext.service.group_index import NetworkGroupIndex
+from ext.service.hosts import get_hosts
+from ext.service.ip_index import IpIndex
+from ext.service.networks import get_networks
+from ext.service.ports import get_port_groups, get_ports
+from ext.service.rule_index import RULE_FIELDS
+from ext.service.security_zones import get_security_zones
+from rich import print as rprint
+
+# Lists indexed by prefix, and the object type of each one
+IP_KINDS = {"networks": "Network", "hosts": "Host"}
+# Types that FMC accepts as literals in the ACP Rules. FQDNs always need an object
+LITERAL_TYPES = frozenset({"Host", "Network", "Port"})
+
+
+def get_acp_policies(fmc):
+    # Imported here because acps.py imports this module
+    from ext.service.acps import get_acp_policies
+
+    return get_acp_policies(fmc)
+
+
+#################################################################################################
+# OBJECT CATALOG
+#################################################################################################
+class ObjectList(dict):
+    """
+    Dict of object name/value and ID that calls on_add for every object added to it, including the objects added
+    in place by get_host_network_id and add_ports
+    """
+
+    def __init__(self, response_data, on_add):
+        super().__init__(response_data)
+        self.__on_add = on_add
+
+    def __setitem__(self, key, id):
+        super().__setitem__(key, id)
+        self.__on_add(key, id)
+
+
+class ObjectCatalog:
+    """
+    Run-scoped catalog of the FMC objects used to build ACP rules. Each object type is downloaded only once, the
+    first time it is needed, and the maps are updated in place whenever a new object is created during the run.
+    All lookups are plain dictionary lookups. If an Inventory is given, the lists are read from the local inventory
+    when they did not change in FMC since the last run. If a Journal is given, the lists and the objects created are
+    recorded in it, and a resumed run reads the lists from it instead of FMC. The Hosts and Networks are also
+    indexed by prefix (see find_network), so an address written in another way reuses the existing object.
+    """
+
+    def __init__(
+        self,
+        fmc,
+        inventory=None,
+        journal=None,
+        network_match="exact",
+        literals=(),
+        group_threshold=0,
+    ):
+        self.__fmc = fmc
+        self.__inventory = inventory
+        self.__journal = journal
+        # exact, covering or string (see find_network)
+        self.__network_match = network_match
+        # Types (Host, Network and Port) written as literals in the rules when there is no object for them
+        self.__literals = frozenset(literals) & LITERAL_TYPES
+        # Lists of networks or ports with at least this number of values are replaced by groups (0 is never)
+        self.__group_threshold = group_threshold
+        # IpIndex of the Hosts and Networks, built the first time it is used
+        self.__ip_index = None
+        self.__ip_index_lock = threading.Lock()
+        # Members of every Network Group, downloaded the first time they are needed
+        self.__group_index = NetworkGroupIndex(fmc)
+        # Label, function that downloads the list and API Paths used to count the objects of the list
+        self.__loaders = {
+            "networks": ("Networks", get_networks, ["object/networks"]),
+            "hosts": ("Hosts", get_hosts, ["object/hosts"]),
+            "fqdns": ("FQDNs", get_fqdn, ["object/fqdns"]),
+            "ports": (
+                "Ports",
+                get_ports,
+                ["object/protocolportobjects", "object/icmpv4objects"],
+            ),
+            "securityzones": (
+                "Security Zones",
+                get_security_zones,
+                ["object/securityzones"],
+            ),
+            "accesspolicies": ("ACPs", get_acp_policies, ["policy/accesspolicies"]),
+            # The names come from the group index, so the Network Groups are downloaded only once
+            "networkgroups": (
+                "Network Groups",
+                lambda fmc: self.__group_index.names(),
+                ["object/networkgroups"],
+            ),
+            "portgroups": ("Port Groups", get_port_groups, ["object/portobjectgroups"]),
+        }
+        self.__lists = {}
+        # Size of each list when it was loaded, to know how many objects were created during the run
+        self.__sizes = {}
+        # Number of times each list was downloaded again after a miss, and the names still missing after that
+        self.__generations = {}
+        self.__missing = {}
+        # Lists read from the inventory instead of FMC. Their IDs are checked when FMC rejects a rule
+        self.__reused = set()
+        # IDs of the inventory that FMC still has, and the new ID of the objects that FMC created again
+        self.__checked = set()
+        self.__replaced = {}
+        # Workers running in parallel wait for the first download instead of starting another one
+        self.__locks = {kind: threading.Lock() for kind in self.__loaders}
+
+    @property
+    def fmc(self):
+        return self.__fmc
+
+    @property
+    def networks(self):
+        return self.get("networks")
+
+    @property
+    def hosts(self):
+        return self.get("hosts")
+
+    @property
+    def fqdns(self):
+        return self.get("fqdns")
+
+    @property
+    def ports(self):
+        return self.get("ports")
+
+    @property
+    def security_zones(self):
+        return self.get("securityzones")
+
+    @property
+    def acp_policies(self):
+        return self.get("accesspolicies")
+
+    @property
+    def network_groups(self):
+        return self.get("networkgroups")
+
+    @property
+    def port_groups(self):
+        return self.get("portgroups")
+
+    @property
+    def literals(self):
+        return self.__literals
+
+    @property
+    def group_threshold(self):
+        return self.__group_threshold
+
+    @property
+    def group_index(self):
+        """
+        NetworkGroupIndex with the members of every Network Group. It is downloaded on the first lookup
+        """
+        return self.__group_index
+
+    def get(self, kind):
+        """
+        This method returns the map of an object type, downloading it from FMC on the first call
+        :param kind: networks, hosts, fqdns, ports, securityzones, accesspolicies, networkgroups or portgroups
+        :return: Dict with the object value as key and the object ID as value
+        """
+        if kind not in self.__lists:
+            with self.__locks[kind]:
+                if kind not in self.__lists:
+                    response_data = None
+                    if self.__journal is not None:
+                        response_data = self.__journal.get_list(kind)
+                    if response_data is None:
+                        response_data = self.__load(kind)
+                    self.__set_list(kind, response_data)
+        return self.__lists[kind]
+
+    def __load(self, kind):
+        # Download a list from FMC (or read it from the inventory) and record it in the journal
+        label, loader, count_paths = self.__loaders[kind]
+        rprint(f"[italic]Colecting {label} List . . . [/italic]")
+        if self.__inventory is None:
+            response_data = loader(self.__fmc)
+        else:
+            response_data = self.__inventory.load(self.__fmc, kind, loader, count_paths)
+        if self.__inventory is not None and self.__inventory.reused(self.__fmc, kind):
+            self.__reused.add(kind)
+        else:
+            self.__reused.discard(kind)
+        if self.__journal is not None:
+            self.__journal.record_list(kind, response_data)
+        return response_data
+
+    def __set_list(self, kind, response_data):
+        if self.__journal is not None or kind in IP_KINDS:
+            response_data = ObjectList(
+                response_data, lambda key, id: self.__on_add(kind, key, id)
+            )
+        if kind in IP_KINDS:
+            # The index is built again from the new list the next time it is used
+            self.__ip_index = None
+        self.__lists[kind] = response_data
+        self.__sizes[kind] = len(response_data)
+
+    def __on_add(self, kind, key, id):
+        # Called for every object added to a list, including the objects added in place by get_host_network_id
+        if self.__journal is not None:
+            self.__journal.record_object(kind, key, id)
+        ip_index = self.__ip_index
+        if ip_index is not None and kind in IP_KINDS:
+            ip_index.add(key, id, IP_KINDS[kind])
+
+    def find_network(self, address):
+        """
+        This method finds the Host or Network of an address comparing prefixes instead of text, so "10.1.1.1",
+        "10.1.1.1/32" and " 10.1.1.1" find the same object. With network_match "covering", if there is no object
+        with the same prefix, the smallest Network that contains the address is returned. With network_match
+        "string", only the exact text is found (the same as the lists)
+        :param address: Host or Network of the CSV file
+        :return: (object ID, object type), or None if there is no object for this address
+        """
+        if self.__network_match == "string":
+            return None
+        ip_index = self.__ip_index
+        if ip_index is None:
+            with self.__ip_index_lock:
+                if self.__ip_index is None:
+                    ip_index = IpIndex()
+                    for kind, object_type in IP_KINDS.items():
+                        # A copy is indexed, since other workers may be adding objects to the list
+                        for value, id in list(self.get(kind).items()):
+                            ip_index.add(value, id, object_type)
+                    self.__ip_index = ip_index
+                ip_index = self.__ip_index
+        return ip_index.lookup(address, covering=self.__network_match == "covering")
+
+    def refresh(self, kind):
+        """
+        This method downloads a list from FMC again, ignoring the inventory and the journal. It is used when the list is stale,
+        for example when FMC says that an object we did not find already exists
+        :param kind: networks, hosts, fqdns, ports, securityzones, accesspolicies, networkgroups or portgroups
+        :return: Dict with the object value as key and the object ID as value
+        """
+        with self.__locks[kind]:
+            if self.__inventory is not None:
+                self.__inventory.invalidate(self.__fmc, kind)
+            if kind == "networkgroups":
+                self.__group_index.invalidate()
+            self.__set_list(kind, self.__load(kind))
+            return self.__lists[kind]
+
+    def lookup(self, kind, key):
+        """
+        This method returns the ID of an object. If the object is not in the list, the list is downloaded again
+        once, since it may have been created after the list was loaded. Workers missing the same list at the same
+        time wait for a single download, and a name still missing after the download does not trigger another one.
+        :param kind: networks, hosts, fqdns, ports, securityzones, accesspolicies, networkgroups or portgroups
+        :param key: Object name or value
+        :return: Object ID, or None if the object does not exist in FMC
+        """
+        object_list = self.get(kind)
+        if key in object_list:
+            return object_list[key]
+        if key in self.__missing.get(kind, ()):
+            return None
+        generation = self.__generations.get(kind, 0)
+        with self.__locks[kind]:
+            # If another worker downloaded the list while we were waiting, use its download
+            if self.__generations.get(kind, 0) == generation:
+                if self.__inventory is not None:
+                    self.__inventory.invalidate(self.__fmc, kind)
+                if kind == "networkgroups":
+                    self.__group_index.invalidate()
+                self.__set_list(kind, self.__load(kind))
+                self.__generations[kind] = generation + 1
+                self.__missing[kind] = set()
+            if key not in self.__lists[kind]:
+                self.__missing[kind].add(key)
+                return None
+            return self.__lists[kind][key]
+
+    def replace_stale_ids(self, post_data):
+        """
+        This method is called when FMC rejects a rule. A list read from the inventory can have the ID of an object
+        deleted in FMC (and created again with another ID), so the IDs of the rule that came from these lists are
+        checked in FMC. The lists with an ID that FMC does not have are downloaded again, and the rule gets the new
+        IDs of its objects
+        :param post_data: JSON of the ACP Rule. It is updated in place
+        :return: True if an ID of the rule was replaced, so the rule can be sent again
+        """
+        if not self.__reused and not self.__replaced:
+            return False
+        elements = [
+            element
+            for field in RULE_FIELDS
+            for element in post_data.get(field, {}).get("objects", [])
+        ]
+        # ID -> (list, object name/value) of the objects read from the inventory
+        reused_ids = {}
+        for kind in list(self.__reused):
+            for key, id in list(self.__lists[kind].items()):
+                reused_ids[id] = (kind, key)
+        stale_kinds = set()
+        for element in elements:
+            id = element["id"]
+            if id not in reused_ids or id in self.__checked or reused_ids[id][0] in stale_kinds:
+                continue
+            r = self.__fmc.request("GET", f"object/{element['type'].lower()}s/{id}")
+            r.close()
+            if r.status_code == 404:
+                stale_kinds.add(reused_ids[id][0])
+            else:
+                self.__checked.add(id)
+
+        for kind in stale_kinds:
+            rprint(f"[yellow]{kind} changed in FMC since it was stored in the inventory. Downloading it again . . .[/yellow]")
+            stale_list = dict(self.__lists[kind])
+            object_list = self.refresh(kind)
+            # The rules already built with the old IDs are fixed too
+            for key, id in stale_list.items():
+                if object_list.get(key, id) != id:
+                    self.__replaced[id] = object_list[key]
+
+        replaced = False
+        for element in elements:
+            if element["id"] in self.__replaced:
+                element["id"] = self.__replaced[element["id"]]
+                replaced = True
+        return replaced
+
+    def add(self, kind, key, id):
+        """
+        This method registers an object created during the run, so the next lookups will find it
+        :param kind: networks, hosts, fqdns, ports, securityzones, accesspolicies, networkgroups or portgroups
+        :param key: Object value (ex: 10.0.0.0/24 or 443/TCP)
+        :param id: Object ID returned by FMC
+        """
+        self.get(kind)[key] = id
+
+    def save(self):
+        """
+        This method saves in the inventory the objects created during the run, so the next run can still use it.
+        The error messages stored instead of an ID are not saved
+        """
+        if self.__inventory is None:
+            return
+        for kind, response_data in self.__lists.items():
+            # IDs never have spaces, while the error messages always do
+            created = {key: id for key, id in response_data.items() if " " not in id}
+            added = len(created) - self.__sizes[kind]
+            if added > 0:
+                self.__inventory.update(self.__fmc, kind, created, added)
+                self.__sizes[kind] = len(created)
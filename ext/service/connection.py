@@ -18,7 +18,8 @@ def make_connection(fmc):
     domain_list = []
 
     try:
-        r = requests.post(
+        r = fmc.send(
+            "POST",
             auth_url,
             headers=headers,
             auth=requests.auth.HTTPBasicAuth(fmc.username, fmc.password),
@@ -41,8 +42,9 @@ def make_connection(fmc):
 
 def refresh_token(fmc, auth_token, refresh_token):
     """
-    This method refreshes the Authentication Token and get a new auth_token, refresh_token and domain_uuid
-    :return: auth_token, domain_uuid, refresh_token
+    This method refreshes the Authentication Token and get a new auth_token and refresh_token
+    :return: auth_token, refresh_token, refreshed: refreshed is False if FMC did not refresh the token and a new one
+    was generated instead
     """
     headers = {
         "Content-Type": "application/json",
@@ -53,7 +55,8 @@ def refresh_token(fmc, auth_token, refresh_token):
     auth_url = "https://" + fmc.ipaddr + api_auth_path
 
     try:
-        r = requests.post(
+        r = fmc.send(
+            "POST",
             auth_url,
             headers=headers,
             auth=requests.auth.HTTPBasicAuth(fmc.username, fmc.password),
@@ -62,13 +65,16 @@ def refresh_token(fmc, auth_token, refresh_token):
         auth_headers = r.headers
         auth_token = auth_headers.get("X-auth-access-token", default=None)
         refresh_token = auth_headers.get("X-auth-refresh-token", default=None)
+        refreshed = True
+        # If FMC does not refresh the token (ex: it was already refreshed 3 times), generate a new one
         if auth_token == None:
-            auth_token, refresh_token, domain_uuid = make_connection()
+            auth_token, refresh_token, domain_list = make_connection(fmc)
+            refreshed = False
     except Exception as err:
         print("Error in generating auth token --> " + str(err))
         sys.exit()
     print("Token refreshed")
-    return auth_token, refresh_token
+    return auth_token, refresh_token, refreshed
 
 
 def validade_token(json_resp):
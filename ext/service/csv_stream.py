@@ -0,0 +1,160 @@
+import csv
+from collections import namedtuple
+
+from ext.service.networks import get_address_type
+
+# One line of the ACP CSV file. The network and port lists are tuples of interned tokens and `fields` keeps the
+# original columns (used by the journal and the domain filter). `merged` has the lines joined in this one by the
+# rule aggregation (see aggregate.py), and is empty for a line that was not aggregated
+AcpRow = namedtuple(
+    "AcpRow",
+    [
+        "row",
+        "fields",
+        "policy",
+        "name",
+        "category",
+        "action",
+        "source_zone",
+        "destination_zone",
+        "source_networks",
+        "destination_networks",
+        "source_ports",
+        "destination_ports",
+        "merged",
+    ],
+    defaults=[()],
+)
+
+
+#################################################################################################
+# TOKEN TABLE
+#################################################################################################
+class TokenTable:
+    """
+    Keeps a single copy of each network and port value found in the CSV files, so a value repeated in thousands of
+    lines uses the memory of one string, and the type of each address (Network, Host, FQDN or NetworkGroup) is
+    found only once. The unique values can be read with networks() and ports().
+    """
+
+    def __init__(self):
+        self.__strings = {}
+        # Address -> address type
+        self.__networks = {}
+        # Port (<PORTNUMBER>/<PROTOCOL> or port group name) -> True
+        self.__ports = {}
+
+    def intern(self, value):
+        return self.__strings.setdefault(value, value)
+
+    def split_networks(self, value):
+        """
+        This method splits a list of networks of the CSV file (separated by ;) and registers each new address
+        :return: Tuple of addresses, empty if the field is empty (any)
+        """
+        addresses = []
+        for address in value.split(";"):
+            address = address.strip()
+            if address == "":
+                continue
+            address = self.intern(address)
+            if address not in self.__networks:
+                self.__networks[address] = get_address_type(address)
+            addresses.append(address)
+        return tuple(addresses)
+
+    def split_ports(self, value):
+        """
+        This method splits a list of ports of the CSV file (separated by ;) and registers each new port
+        :return: Tuple of ports, empty if the field is empty (any)
+        """
+        ports = []
+        for port in value.split(";"):
+            port = port.strip()
+            if port == "":
+                continue
+            port = self.intern(port)
+            self.__ports[port] = True
+            ports.append(port)
+        return tuple(ports)
+
+    def address_type(self, address):
+        """
+        :return: Network, Host, FQDN or NetworkGroup
+        """
+        address_type = self.__networks.get(address)
+        if address_type is None:
+            address_type = get_address_type(address)
+            self.__networks[self.intern(address)] = address_type
+        return address_type
+
+    def networks(self, address_type=None):
+        """
+        This method returns the unique addresses, in the order they were found
+        :param address_type: If set, only the addresses of this type are returned
+        """
+        return [
+            address
+            for address, network_type in self.__networks.items()
+            if address_type is None or network_type == address_type
+        ]
+
+    def ports(self):
+        return list(self.__ports)
+
+
+#################################################################################################
+# CSV STREAM
+#################################################################################################
+def read_acps(csv_input, tokens=None, row_filter=None):
+    """
+    This method reads the ACP CSV file one line at a time, so the memory used does not depend on the size of the
+    file. The header, the comments and the lines rejected by row_filter are skipped.
+    :param tokens: TokenTable where the networks and ports are interned. A new one is used if None
+    :param row_filter: Function that receives the columns of a line and returns False if it must be skipped
+    :return: Generator of AcpRow
+    """
+    if tokens is None:
+        tokens = TokenTable()
+    with open(csv_input, "r") as input_file:
+        input_csv = csv.reader(input_file, delimiter=",")
+        for row, fields in enumerate(input_csv, start=1):
+            # Skip empty lines, header line, comments and lines of other domains
+            if not fields or fields[0].startswith("#"):
+                continue
+            if row_filter and not row_filter(fields):
+                continue
+            # The columns repeated in many lines (Policy, Category, Zones, ...) are stored once. Rule names are unique
+            fields = [
+                field if column == 1 else tokens.intern(field)
+                for column, field in enumerate(fields)
+            ]
+            # Missing columns at the end of the line are empty
+            columns = fields + [""] * (10 - len(fields))
+            yield AcpRow(
+                row,
+                fields,
+                columns[0],
+                columns[1],
+                columns[2],
+                columns[3],
+                columns[4],
+                columns[5],
+                tokens.split_networks(columns[6]),
+                tokens.split_networks(columns[7]),
+                tokens.split_ports(columns[8]),
+                tokens.split_ports(columns[9]),
+            )
+
+
+def scan_tokens(csv_input, row_filter=None, tokens=None):
+    """
+    This method reads the whole ACP CSV file and returns only its unique networks and ports
+    :param tokens: TokenTable filled with the networks and ports. A new one is used if None
+    :return: TokenTable
+    """
+    if tokens is None:
+        tokens = TokenTable()
+    for acp in read_acps(csv_input, tokens, row_filter):
+        pass
+    return tokens
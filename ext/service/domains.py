@@ -1,7 +1,17 @@
-from ext.service.connection import make_connection
+import asyncio
+import csv
+from concurrent.futures import ThreadPoolExecutor
+
 from rich import print as rprint
 from rich.console import Console
 
+from ext.service.acps import add_acp
+from ext.service.AsyncFMC import AsyncFMC
+from ext.service.async_acps import add_acp_async
+
+# Index of the optional Domain column in the CSV file
+DOMAIN_COLUMN = 10
+
 
 def get_domains(fmc):
     console = Console()
@@ -10,7 +20,7 @@ def get_domains(fmc):
         rprint(
             "[italic]Please wait while we collect the list of domains . . .[/italic]"
         )
-        auth_token, refresh_token, domain_list = make_connection(fmc)
+        domain_list = fmc.token_manager.authenticate()
         try:
             if len(domain_list) > 1:
                 counter = 1
@@ -39,6 +49,106 @@ def get_domains(fmc):
             continue
 
         fmc.domain = domain_uuid
-        fmc.authtoken = auth_token
-        fmc.refreshtoken = refresh_token
         return fmc
+
+
+#################################################################################################
+# MULTI DOMAIN
+#################################################################################################
+def get_row_domains(acp):
+    """
+    This method returns the domains of a CSV line, from the optional Domain column (names separated by ";")
+    :return: List of domain names. Empty if the line has no domain
+    """
+    if len(acp) <= DOMAIN_COLUMN:
+        return []
+    return [domain for domain in acp[DOMAIN_COLUMN].split(";") if domain != ""]
+
+
+def get_csv_domains(csv_input):
+    """
+    This method returns every domain used in the Domain column of the CSV file, in the order they appear
+    """
+    domains = {}
+    with open(csv_input, "r") as input_file:
+        for acp in csv.reader(input_file, delimiter=","):
+            if acp and not acp[0].startswith("#"):
+                domains.update(dict.fromkeys(get_row_domains(acp)))
+    return list(domains)
+
+
+def domain_row_filter(domain_name, default_domains):
+    """
+    This method returns the row_filter of a domain: a line is added to the domains of its Domain column or, if the
+    column is empty, to the default domains
+    """
+
+    def row_filter(acp):
+        row_domains = get_row_domains(acp)
+        if row_domains:
+            return domain_name in row_domains
+        return domain_name in default_domains
+
+    return row_filter
+
+
+def add_acp_domains(
+    fmc, csv_input, default_domains, workers=4, concurrency=0, journals=None, **acp_options
+):
+    """
+    This method adds the ACPs of a CSV File in many domains at the same time. Each domain has its own catalog, but
+    every domain shares the same login, Session and rate limit.
+    :param default_domains: Names of the domains that receive the lines without a Domain column
+    :param workers: Number of domains configured at the same time
+    :param concurrency: If greater than 0, add_acp_async is used in each domain with this concurrency
+    :param journals: Dict with the Journal of each domain name
+    :param acp_options: Options of add_acp (bulk_size, bulk_objects, inventory)
+    :return: response_data: Dict with the result of each domain
+    """
+    journals = journals or {}
+    domain_list = fmc.token_manager.authenticate()
+    domain_uuids = {domain["name"]: domain["uuid"] for domain in domain_list}
+
+    response_data = {}
+    domain_names = []
+    for domain_name in dict.fromkeys(list(default_domains) + get_csv_domains(csv_input)):
+        if domain_name in domain_uuids:
+            domain_names.append(domain_name)
+        else:
+            rprint(f"[red]Domain {domain_name} does not exist![/red]")
+            response_data[domain_name] = "Domain does not exist"
+    rprint(
+        f"[yellow]Configurations will be made on the domains [bold]{', '.join(domain_names)}[/bold][/yellow]"
+    )
+    fmc.domain = domain_uuids[domain_names[0]] if domain_names else fmc.domain
+
+    def add_domain(domain_name):
+        return add_acp(
+            fmc.for_domain(domain_uuids[domain_name]),
+            csv_input,
+            journal=journals.get(domain_name),
+            row_filter=domain_row_filter(domain_name, default_domains),
+            **acp_options,
+        )
+
+    async def add_domains_async():
+        return await asyncio.gather(
+            *[
+                add_acp_async(
+                    AsyncFMC(fmc.for_domain(domain_uuids[domain_name]), concurrency),
+                    csv_input,
+                    journal=journals.get(domain_name),
+                    row_filter=domain_row_filter(domain_name, default_domains),
+                    **acp_options,
+                )
+                for domain_name in domain_names
+            ]
+        )
+
+    if concurrency > 0:
+        results = asyncio.run(add_domains_async())
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = list(executor.map(add_domain, domain_names))
+    response_data.update(zip(domain_names, results))
+    return response_data
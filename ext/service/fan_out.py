@@ -0,0 +1,196 @@
+import asyncio
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+
+from rich import print as rprint
+from rich.console import Console
+from rich.table import Table
+
+from ext.service.acps import add_acp
+from ext.service.AsyncFMC import AsyncFMC
+from ext.service.async_acps import add_acp_async
+from ext.service.domains import add_acp_domains, get_csv_domains
+from ext.service.FMC import FMC
+from ext.service.inventory import Inventory
+from ext.service.journal import Journal
+
+
+#################################################################################################
+# FAN OUT
+#################################################################################################
+def get_target_name(target):
+    return target.get("name", target["fmc_ip"])
+
+
+def get_target_csv(target, default_csv):
+    return target.get("csv", default_csv)
+
+
+def get_journal_path(target, default_csv):
+    name = get_target_name(target).replace("/", "_").replace(":", "_")
+    return f"{get_target_csv(target, default_csv)}.{name}.journal"
+
+
+def run_target(target, config, default_csv, resume=False):
+    """
+    This method adds the ACPs of a CSV File in one FMC. It runs in a worker process, with its own Session, token
+    and rate limit. The messages of the run are written to <CSV>.<NAME>.log.
+    :param target: FMC of the "fmcs" list of the config file
+    :param config: Config file. The settings not set in the target (pool_size, rate_limit, acp_options, ...) are
+    read from here
+    :param default_csv: CSV File used when the target has no "csv"
+    :param resume: If True, the journal of the previous run is resumed
+    :return: Dict with the results and timings of this FMC
+    """
+    settings = dict(config)
+    settings.update(target)
+    csv_input = get_target_csv(target, default_csv)
+    name = get_target_name(target)
+    result = {"name": name, "fmc_ip": target["fmc_ip"], "csv": csv_input}
+    start = time.perf_counter()
+
+    log_path = f"{csv_input}.{name.replace('/', '_').replace(':', '_')}.log"
+    result["log"] = log_path
+    with open(log_path, "w") as log_file, redirect_stdout(log_file):
+        journal = None
+        try:
+            fmc = FMC(
+                target["fmc_ip"],
+                target["fmc_user"],
+                target["fmc_passwd"],
+                pool_size=settings.get("pool_size", 10),
+                rate_limit=settings.get("rate_limit", 120),
+                page_workers=settings.get("page_workers", 4),
+            )
+            acp_options = dict(settings.get("acp_options", {}))
+            # Each process opens its own connection to the inventory
+            if "inventory" in settings:
+                acp_options["inventory"] = Inventory(**settings["inventory"])
+            concurrency = settings.get("concurrency", 0)
+
+            if "domains" in settings:
+                journals = {}
+                if settings.get("journal", False):
+                    journals = {
+                        domain_name: Journal(
+                            f"{get_journal_path(target, default_csv)}.{domain_name.replace('/', '_')}",
+                            resume,
+                        )
+                        for domain_name in dict.fromkeys(
+                            settings["domains"] + get_csv_domains(csv_input)
+                        )
+                    }
+                status = add_acp_domains(
+                    fmc,
+                    csv_input,
+                    settings["domains"],
+                    workers=settings.get("domain_workers", 4),
+                    concurrency=concurrency,
+                    journals=journals,
+                    **acp_options,
+                )
+                for domain_journal in journals.values():
+                    domain_journal.close()
+            else:
+                # The domain is not asked to the user: the "domain" of the target is used, or the first one
+                domain_list = fmc.token_manager.authenticate()
+                fmc.domain = domain_list[0]["uuid"]
+                for domain in domain_list:
+                    if domain["name"] == settings.get("domain"):
+                        fmc.domain = domain["uuid"]
+                if settings.get("journal", False):
+                    journal = Journal(get_journal_path(target, default_csv), resume)
+                if concurrency > 0:
+                    status = asyncio.run(
+                        add_acp_async(
+                            AsyncFMC(fmc, concurrency), csv_input, journal=journal, **acp_options
+                        )
+                    )
+                else:
+                    status = add_acp(fmc, csv_input, journal=journal, **acp_options)
+
+            result["status"] = status
+            result["usage"] = fmc.rate_limiter.usage()
+            result["metrics"] = fmc.metrics.summary()
+        except BaseException:
+            # sys.exit is used by the connection helpers when the login fails
+            result["error"] = traceback.format_exc()
+            print(result["error"])
+        finally:
+            if journal is not None:
+                journal.close()
+    result["wall_time"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def add_acp_fmcs(targets, config, default_csv, processes=4, resume=False):
+    """
+    This method adds the ACPs in many FMCs at the same time, one worker process per FMC
+    :param targets: "fmcs" list of the config file. Each FMC has fmc_ip, fmc_user, fmc_passwd and, optionally,
+    name, csv, domain, domains and any other setting of the config file
+    :param processes: Number of FMCs configured at the same time
+    :return: List with the results of each FMC, in the order of the targets
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=max(1, processes)) as executor:
+        futures = {
+            executor.submit(run_target, target, config, default_csv, resume): index
+            for index, target in enumerate(targets)
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            if "error" in result:
+                rprint(f"[red]{result['name']} failed after {result['wall_time']} seconds![/red]")
+            else:
+                rprint(f"[green]{result['name']} finished in {result['wall_time']} seconds[/green]")
+            results[futures[future]] = result
+    return [results[index] for index in range(len(targets))]
+
+
+def count_errors(status):
+    """
+    This method counts the rules that were not added. IDs never have spaces, while the error messages always do
+    """
+    errors = 0
+    for value in status.values():
+        if isinstance(value, dict):
+            errors += count_errors(value)
+        elif " " in value:
+            errors += 1
+    return errors
+
+
+def count_rules(status):
+    rules = 0
+    for value in status.values():
+        rules += count_rules(value) if isinstance(value, dict) else 1
+    return rules
+
+
+def print_report(results):
+    table = Table(title="ACPs added by FMC")
+    table.add_column("FMC")
+    table.add_column("CSV")
+    for column in ("Rules", "Errors", "API calls", "Throttled", "Wall time (s)"):
+        table.add_column(column, justify="right")
+    for result in results:
+        if "error" in result:
+            table.add_row(
+                result["name"], result["csv"], "-", "[red]failed[/red]", "-", "-", f"{result['wall_time']:.1f}"
+            )
+            continue
+        table.add_row(
+            result["name"],
+            result["csv"],
+            str(count_rules(result["status"])),
+            str(count_errors(result["status"])),
+            str(result["usage"]["requests"]),
+            str(result["usage"]["throttled"]),
+            f"{result['wall_time']:.1f}",
+        )
+    Console().print(table)
+    for result in results:
+        if "error" in result:
+            rprint(f"[red]{result['name']} failed. Check {result['log']}[/red]")
@@ -0,0 +1,172 @@
+import ipaddress
+import threading
+
+from ext.service.networks import get_network_groups_expanded
+from rich import print as rprint
+
+
+#################################################################################################
+# NETWORK GROUP INDEX
+#################################################################################################
+class NetworkGroupIndex:
+    """
+    Index of the members of every Network Group, downloaded with a single paginated GET (expanded) instead of one
+    GET per group. Nested groups are flattened, so the members of a group are every Host, Network, Range, FQDN and
+    literal it contains directly or through other groups. Two indexes are kept: group -> members and
+    member -> groups, so finding a group with exactly the addresses of a rule does not need any request. The names
+    and IDs of the groups are also the Network Group list of the ObjectCatalog. A member is the ID of an object, or the canonical prefix of a literal
+    (ex: 10.1.1.1/32). It is thread safe.
+    """
+
+    def __init__(self, fmc):
+        self.__fmc = fmc
+        self.__lock = threading.Lock()
+        self.__loaded = False
+        # Group name -> group ID
+        self.__names = {}
+        # Group ID -> (members that are not groups, IDs of the nested groups)
+        self.__groups = {}
+        # Group ID -> flattened members
+        self.__members = {}
+        # Member -> IDs of the groups that contain it, directly or through nested groups
+        self.__reverse = {}
+
+    @staticmethod
+    def member_key(element):
+        """
+        This method returns the member of an element of the objects or literals of a group
+        :param element: {"type": "Host", "id": ...} or {"type": "Network", "value": "10.0.0.0/8"}
+        :return: Object ID, or canonical prefix of the literal
+        """
+        if "id" in element:
+            return element["id"]
+        return NetworkGroupIndex.literal_key(element["value"])
+
+    @staticmethod
+    def literal_key(value):
+        """
+        This method returns the canonical form of a literal, so "10.1.1.1" and "10.1.1.1/32" are the same member
+        """
+        try:
+            return str(ipaddress.ip_network(value.strip(), strict=False))
+        except ValueError:
+            return value.strip()
+
+    def load(self):
+        """
+        This method downloads every Network Group, if they were not downloaded yet
+        """
+        if self.__loaded:
+            return
+        with self.__lock:
+            if self.__loaded:
+                return
+            rprint("[italic]Colecting Network Groups members . . . [/italic]")
+            self.__names = {}
+            self.__groups = {}
+            self.__members = {}
+            self.__reverse = {}
+            for group in get_network_groups_expanded(self.__fmc):
+                self.__add_group(group)
+            self.__index()
+            self.__loaded = True
+
+    def __add_group(self, group):
+        members = []
+        nested = []
+        for element in group.get("objects", []):
+            if element.get("type") == "NetworkGroup":
+                nested.append(element["id"])
+            else:
+                members.append(self.member_key(element))
+        for element in group.get("literals", []):
+            members.append(self.member_key(element))
+        self.__names[group["name"]] = group["id"]
+        self.__groups[group["id"]] = (members, nested)
+
+    def __flatten(self, group_id):
+        # Flattened members of a group. Every group is visited once, even if groups contain each other
+        if group_id in self.__members:
+            return self.__members[group_id]
+        flattened = set()
+        visited = {group_id}
+        pending = [group_id]
+        while pending:
+            current = pending.pop()
+            if current != group_id and current in self.__members:
+                flattened |= self.__members[current]
+                continue
+            members, nested = self.__groups.get(current, ((), ()))
+            flattened.update(members)
+            for nested_id in nested:
+                if nested_id not in visited:
+                    visited.add(nested_id)
+                    pending.append(nested_id)
+        self.__members[group_id] = frozenset(flattened)
+        return self.__members[group_id]
+
+    def __index(self):
+        for group_id in self.__groups:
+            for member in self.__flatten(group_id):
+                self.__reverse.setdefault(member, set()).add(group_id)
+
+    def add(self, group):
+        """
+        This method indexes a group created during the run
+        :param group: JSON of the group, with name, id, objects and literals
+        """
+        self.load()
+        with self.__lock:
+            self.__add_group(group)
+            for member in self.__flatten(group["id"]):
+                self.__reverse.setdefault(member, set()).add(group["id"])
+
+    def invalidate(self):
+        """
+        This method makes the next lookup download the Network Groups again, ex: when a group was not found
+        """
+        with self.__lock:
+            self.__loaded = False
+
+    def names(self):
+        """
+        :return: Dict with the name and ID of every Network Group
+        """
+        self.load()
+        with self.__lock:
+            return dict(self.__names)
+
+    def members(self, group_id):
+        """
+        :return: Flattened members of a group (empty if the group does not exist)
+        """
+        self.load()
+        with self.__lock:
+            return self.__members.get(group_id, frozenset())
+
+    def __covering(self, members):
+        groups = None
+        # The smallest reverse sets are intersected first
+        for member_groups in sorted(
+            (self.__reverse.get(member, set()) for member in members), key=len
+        ):
+            groups = set(member_groups) if groups is None else groups & member_groups
+            if not groups:
+                break
+        return groups or set()
+
+    def find_group(self, members):
+        """
+        This method finds a group with exactly these members, so it can be used instead of the members in a rule
+        :param members: Object IDs or canonical prefixes
+        :return: Group ID, or None if no group has exactly these members
+        """
+        members = frozenset(members)
+        if not members:
+            return None
+        self.load()
+        with self.__lock:
+            for group_id in sorted(self.__covering(members)):
+                if self.__members[group_id] == members:
+                    return group_id
+        return None
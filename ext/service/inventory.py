@@ -0,0 +1,170 @@
+import json
+import sqlite3
+import threading
+import time
+
+from rich import print as rprint
+
+
+#################################################################################################
+# INVENTORY
+#################################################################################################
+class Inventory:
+    """
+    Local SQLite copy of the lists downloaded from FMC (name/value and ID of each object), keyed by FMC IP, domain
+    UUID and list. A list is reused on the next run if it is younger than max_age seconds and, when check_count is
+    True, if FMC still reports the same number of objects for it (one small GET instead of downloading every page).
+    Otherwise the list is downloaded again and stored. The count does not see an object deleted and another one
+    created, so the IDs of a reused list can still be stale: see ObjectCatalog.replace_stale_ids.
+    """
+
+    def __init__(self, path="ext/config/inventory.db", max_age=86400, check_count=True):
+        self.__path = path
+        self.__max_age = max_age
+        self.__check_count = check_count
+        self.__lock = threading.Lock()
+        # (FMC IP, domain UUID, list) of the lists that the last load read from the inventory
+        self.__reused = set()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        with self.__db:
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS lists (fmc_ip TEXT, domain TEXT, kind TEXT, count INTEGER, "
+                "updated REAL, PRIMARY KEY (fmc_ip, domain, kind))"
+            )
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS objects (fmc_ip TEXT, domain TEXT, kind TEXT, key TEXT, id TEXT, "
+                "PRIMARY KEY (fmc_ip, domain, kind, key))"
+            )
+
+    @property
+    def path(self):
+        return self.__path
+
+    def load(self, fmc, kind, loader, count_paths):
+        """
+        This method returns a list from the inventory, or downloads it from FMC if it is missing or stale
+        :param kind: Name of the list, ex: networks
+        :param loader: Function that downloads the list from FMC, ex: get_networks
+        :param count_paths: API Paths used to count the objects of the list in FMC, ex: ["object/networks"]
+        :return: Dict with the object name/value as key and the object ID as value
+        """
+        with self.__lock:
+            cached = self.__db.execute(
+                "SELECT count, updated FROM lists WHERE fmc_ip=? AND domain=? AND kind=?",
+                (fmc.ipaddr, fmc.domain, kind),
+            ).fetchone()
+
+        key = (fmc.ipaddr, fmc.domain, kind)
+        self.__reused.discard(key)
+        if cached is not None and time.time() - cached[1] < self.__max_age:
+            if not self.__check_count:
+                self.__reused.add(key)
+                return self.__read(fmc, kind)
+            count = self.count(fmc, count_paths)
+            if count is not None and count == cached[0]:
+                self.__reused.add(key)
+                return self.__read(fmc, kind)
+            rprint(
+                f"[italic]{kind} changed in FMC ({cached[0]} -> {count}), downloading it again . . .[/italic]"
+            )
+            response_data = loader(fmc)
+        else:
+            response_data = loader(fmc)
+            count = self.count(fmc, count_paths)
+        # Without the count, the list could not be checked on the next run, so it is not kept
+        if count is None:
+            rprint(f"[yellow]Could not count {kind} in FMC. It will be downloaded again on the next run[/yellow]")
+            self.invalidate(fmc, kind)
+            return response_data
+        self.store(fmc, kind, response_data, count)
+        return response_data
+
+    def reused(self, fmc, kind):
+        """
+        This method tells if the last load of a list read it from the inventory instead of FMC
+        """
+        return (fmc.ipaddr, fmc.domain, kind) in self.__reused
+
+    def count(self, fmc, count_paths):
+        """
+        This method asks FMC how many objects a list has, using a GET with limit=1 for each path
+        :return: Total number of objects, or None if FMC did not answer the count
+        """
+        total = 0
+        for path in count_paths:
+            r = fmc.request("GET", f"{path}?offset=0&limit=1")
+            try:
+                total += json.loads(r.text)["paging"]["count"]
+            except (KeyError, ValueError):
+                return None
+            finally:
+                r.close()
+        return total
+
+    def store(self, fmc, kind, response_data, count):
+        """
+        This method replaces a list in the inventory
+        :param response_data: Dict with the object name/value as key and the object ID as value
+        :param count: Number of objects reported by FMC
+        """
+        with self.__lock, self.__db:
+            self.__db.execute(
+                "DELETE FROM objects WHERE fmc_ip=? AND domain=? AND kind=?",
+                (fmc.ipaddr, fmc.domain, kind),
+            )
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                [
+                    (fmc.ipaddr, fmc.domain, kind, key, id)
+                    for key, id in response_data.items()
+                ],
+            )
+            self.__db.execute(
+                "INSERT OR REPLACE INTO lists VALUES (?, ?, ?, ?, ?)",
+                (fmc.ipaddr, fmc.domain, kind, count, time.time()),
+            )
+
+    def update(self, fmc, kind, response_data, added):
+        """
+        This method saves the objects created during the run, so the list stays valid for the next run
+        :param response_data: Dict with the object name/value as key and the object ID as value. It must only have
+        objects that FMC created, since their number is added to the count
+        :param added: Number of objects created in FMC since the list was loaded
+        """
+        with self.__lock, self.__db:
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                [
+                    (fmc.ipaddr, fmc.domain, kind, key, id)
+                    for key, id in response_data.items()
+                ],
+            )
+            self.__db.execute(
+                "UPDATE lists SET count = count + ? WHERE fmc_ip=? AND domain=? AND kind=?",
+                (added, fmc.ipaddr, fmc.domain, kind),
+            )
+
+    def invalidate(self, fmc, kind=None):
+        """
+        This method removes a list (or every list, if kind is None) of this FMC and domain from the inventory, so
+        it will be downloaded again on the next load
+        """
+        with self.__lock, self.__db:
+            if kind is None:
+                self.__db.execute(
+                    "DELETE FROM lists WHERE fmc_ip=? AND domain=?",
+                    (fmc.ipaddr, fmc.domain),
+                )
+            else:
+                self.__db.execute(
+                    "DELETE FROM lists WHERE fmc_ip=? AND domain=? AND kind=?",
+                    (fmc.ipaddr, fmc.domain, kind),
+                )
+
+    def __read(self, fmc, kind):
+        with self.__lock:
+            rows = self.__db.execute(
+                "SELECT key, id FROM objects WHERE fmc_ip=? AND domain=? AND kind=?",
+                (fmc.ipaddr, fmc.domain, kind),
+            ).fetchall()
+        return dict(rows)
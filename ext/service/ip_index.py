@@ -0,0 +1,81 @@
+import ipaddress
+
+# Number of bits of the addresses of each IP version
+ADDRESS_BITS = {4: 32, 6: 128}
+
+
+#################################################################################################
+# IP INDEX
+#################################################################################################
+class IpIndex:
+    """
+    Index of the Host and Network objects by prefix instead of by text. Each value is converted to its IP version,
+    network address (as an integer) and prefix length, so "10.1.1.0/24", " 10.1.1.0/24" and "10.1.1.5/24" are the
+    same prefix, and the Host "10.1.1.1" is the same as the Network "10.1.1.1/32". The prefixes are kept in one
+    table per prefix length, so a lookup checks at most 33 (IPv4) or 129 (IPv6) tables, however many objects
+    there are, and the smallest object containing a prefix is found by checking the tables from the longest
+    prefix length to the shortest.
+    """
+
+    def __init__(self):
+        # (IP version, prefix length) -> {network address: (object ID, object type)}
+        self.__tables = {}
+        # IP version -> prefix lengths with at least one object, longest first
+        self.__lengths = {4: [], 6: []}
+
+    @staticmethod
+    def prefix(address):
+        """
+        This method returns the canonical form of an address
+        :param address: Host (ex: 10.1.1.1) or Network (ex: 10.1.1.0/24) of IPv4 or IPv6
+        :return: (IP version, network address as integer, prefix length), or None if it is not an IP address
+        """
+        try:
+            network = ipaddress.ip_network(address.strip(), strict=False)
+        except ValueError:
+            return None
+        return network.version, int(network.network_address), network.prefixlen
+
+    def add(self, address, id, type):
+        """
+        This method indexes an object. If another object already has the same prefix, the first one is kept
+        :param address: Value of the object in FMC
+        :param type: Host or Network
+        """
+        prefix = self.prefix(address)
+        if prefix is None:
+            return
+        version, value, length = prefix
+        table = self.__tables.get((version, length))
+        if table is None:
+            table = self.__tables.setdefault((version, length), {})
+            self.__lengths[version] = sorted(
+                set(self.__lengths[version]) | {length}, reverse=True
+            )
+        table.setdefault(value, (id, type))
+
+    def lookup(self, address, covering=False):
+        """
+        This method finds the object of an address
+        :param covering: If True and no object has the same prefix, the smallest object that contains the address
+        is returned
+        :return: (object ID, object type), or None if there is no object
+        """
+        prefix = self.prefix(address)
+        if prefix is None:
+            return None
+        version, value, length = prefix
+        bits = ADDRESS_BITS[version]
+        for table_length in self.__lengths[version]:
+            if table_length > length:
+                continue
+            if table_length < length and not covering:
+                break
+            mask = ((1 << table_length) - 1) << (bits - table_length)
+            entry = self.__tables[(version, table_length)].get(value & mask)
+            if entry is not None:
+                return entry
+        return None
+
+    def __len__(self):
+        return sum(len(table) for table in self.__tables.values())
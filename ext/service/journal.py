@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import threading
+
+
+#################################################################################################
+# JOURNAL
+#################################################################################################
+class Journal:
+    """
+    Append-only file (one JSON per line) with the work already done by add_acp: the lists downloaded from FMC, the
+    objects, Policies and Categories created and the rules added, keyed by a hash of the CSV line. Each line is
+    written to disk before the next request, so if the run is interrupted it can be resumed: the rules already added
+    are skipped and the lists are read from the journal instead of FMC.
+    """
+
+    def __init__(self, path, resume=False):
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__lists = {}
+        # Objects created for lists that were not recorded (they are only used if the list is recorded later)
+        self.__objects = {}
+        self.__categories = set()
+        self.__rules = {}
+        if resume and os.path.exists(path):
+            self.__replay()
+        # A new run starts a new journal. A resumed run keeps appending to the same one
+        self.__file = open(path, "a" if resume else "w")
+        # If the run was killed while writing a line, end it so the next entry starts on a new line
+        if self.__file.tell() > 0:
+            with open(path, "rb") as journal_file:
+                journal_file.seek(-1, os.SEEK_END)
+                if journal_file.read(1) != b"\n":
+                    self.__file.write("\n")
+
+    @property
+    def path(self):
+        return self.__path
+
+    @staticmethod
+    def row_hash(acp):
+        """
+        This method returns the key of a CSV line in the journal
+        :param acp: CSV line
+        """
+        return hashlib.sha256(json.dumps(acp).encode()).hexdigest()
+
+    def __replay(self):
+        with open(self.__path, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete if the run was killed while writing it
+                    continue
+                if entry["type"] == "list":
+                    self.__lists[entry["kind"]] = entry["data"]
+                elif entry["type"] == "object":
+                    if entry["kind"] in self.__lists:
+                        self.__lists[entry["kind"]][entry["key"]] = entry["id"]
+                    else:
+                        self.__objects.setdefault(entry["kind"], {})[entry["key"]] = entry["id"]
+                elif entry["type"] == "category":
+                    self.__categories.add((entry["policy_id"], entry["name"]))
+                elif entry["type"] == "rule":
+                    self.__rules[entry["row_hash"]] = {entry["name"]: entry["id"]}
+
+    def __write(self, entry):
+        with self.__lock:
+            self.__file.write(json.dumps(entry) + "\n")
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+
+    #################################################################################################
+    # RECORD
+    #################################################################################################
+    def record_list(self, kind, response_data):
+        self.__lists[kind] = dict(response_data)
+        self.__write({"type": "list", "kind": kind, "data": response_data})
+
+    def record_object(self, kind, key, id):
+        self.__write({"type": "object", "kind": kind, "key": key, "id": id})
+
+    def record_category(self, policy_id, name):
+        self.__categories.add((policy_id, name))
+        self.__write({"type": "category", "policy_id": policy_id, "name": name})
+
+    def record_rule(self, row_hash, name, id):
+        self.__rules[row_hash] = {name: id}
+        self.__write({"type": "rule", "row_hash": row_hash, "name": name, "id": id})
+
+    #################################################################################################
+    # READ
+    #################################################################################################
+    def get_list(self, kind):
+        """
+        This method returns a list recorded in the journal, with the objects created after it was recorded
+        :return: Dict with the object name/value as key and the object ID as value, or None if it was not recorded
+        """
+        if kind not in self.__lists:
+            return None
+        response_data = dict(self.__lists[kind])
+        response_data.update(self.__objects.get(kind, {}))
+        return response_data
+
+    def has_category(self, policy_id, name):
+        return (policy_id, name) in self.__categories
+
+    def get_rule(self, row_hash):
+        """
+        This method returns the rule added for a CSV line
+        :return: Dict with the rule name and ID, or None if the line was not added yet
+        """
+        return self.__rules.get(row_hash)
+
+    def close(self):
+        self.__file.close()
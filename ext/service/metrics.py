@@ -0,0 +1,193 @@
+import json
+import re
+import threading
+from urllib.parse import urlsplit
+
+from rich.console import Console
+from rich.table import Table
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+API_PREFIX = re.compile(r"^/api/(fmc_config/v1/domain/[^/]+|fmc_platform/v1)/")
+ID_IN_PATH = re.compile(
+    r"/[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+)
+
+
+#################################################################################################
+# API METRICS
+#################################################################################################
+class ApiMetrics:
+    """
+    Collects one record for each request sent to FMC: method, endpoint, status code, latency, response size and
+    retries after 429. The endpoint is the API path without the prefix, the IDs and the query, ex:
+    "policy/accesspolicies/{id}/accessrules" or "auth/refreshtoken", so the calls are aggregated by endpoint in a
+    latency histogram. The token generations and refreshes are counted too. It is thread safe.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__endpoints = {}
+        self.__tokens = {}
+
+    @staticmethod
+    def endpoint(url):
+        """
+        This method returns the endpoint template of an URL
+        :param url: Full URL, ex: https://1.1.1.1/api/fmc_config/v1/domain/<UUID>/object/hosts?offset=0
+        :return: Endpoint, ex: object/hosts
+        """
+        path = API_PREFIX.sub("", urlsplit(url).path)
+        return ID_IN_PATH.sub("/{id}", path)
+
+    def record(self, method, url, status, latency, size, retries=0):
+        """
+        This method records a request
+        :param status: Status code of the last answer
+        :param latency: Seconds waiting for FMC, summing every attempt
+        :param size: Bytes of the answer
+        :param retries: Number of times the request was sent again after a 429
+        """
+        key = (method, self.endpoint(url))
+        with self.__lock:
+            stats = self.__endpoints.get(key)
+            if stats is None:
+                stats = {
+                    "calls": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "bytes": 0,
+                    "latency_sum": 0.0,
+                    "latency_max": 0.0,
+                    "status": {},
+                    "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+                }
+                self.__endpoints[key] = stats
+            stats["calls"] += 1
+            stats["retries"] += retries
+            stats["bytes"] += size
+            stats["latency_sum"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+            stats["status"][status] = stats["status"].get(status, 0) + 1
+            if status >= 400:
+                stats["errors"] += 1
+            bucket = len(LATENCY_BUCKETS)
+            for index, upper_bound in enumerate(LATENCY_BUCKETS):
+                if latency <= upper_bound:
+                    bucket = index
+                    break
+            stats["buckets"][bucket] += 1
+
+    def record_token(self, event):
+        """
+        This method counts a token event
+        :param event: generate, refresh or invalid
+        """
+        with self.__lock:
+            self.__tokens[event] = self.__tokens.get(event, 0) + 1
+
+    #################################################################################################
+    # REPORT
+    #################################################################################################
+    def summary(self):
+        """
+        This method returns the metrics of every endpoint, the slowest (most total time) first
+        :return: Dict with the endpoints and the token events
+        """
+        with self.__lock:
+            endpoints = []
+            for (method, endpoint), stats in self.__endpoints.items():
+                endpoints.append(
+                    {
+                        "method": method,
+                        "endpoint": endpoint,
+                        "calls": stats["calls"],
+                        "errors": stats["errors"],
+                        "retries": stats["retries"],
+                        "bytes": stats["bytes"],
+                        "latency_sum": round(stats["latency_sum"], 3),
+                        "latency_avg": round(stats["latency_sum"] / stats["calls"], 3),
+                        "latency_max": round(stats["latency_max"], 3),
+                        "status": {str(code): count for code, count in stats["status"].items()},
+                        "buckets": dict(
+                            zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], stats["buckets"])
+                        ),
+                    }
+                )
+            tokens = dict(self.__tokens)
+        endpoints.sort(key=lambda stats: stats["latency_sum"], reverse=True)
+        return {"endpoints": endpoints, "tokens": tokens}
+
+    def print_summary(self):
+        summary = self.summary()
+        table = Table(title="FMC API calls")
+        table.add_column("Method")
+        table.add_column("Endpoint", overflow="fold")
+        for column in ("Calls", "Errors", "429 Retries", "Total (s)", "Avg (s)", "Max (s)", "KB"):
+            table.add_column(column, justify="right")
+        for stats in summary["endpoints"]:
+            table.add_row(
+                stats["method"],
+                stats["endpoint"],
+                str(stats["calls"]),
+                str(stats["errors"]),
+                str(stats["retries"]),
+                f"{stats['latency_sum']:.2f}",
+                f"{stats['latency_avg']:.3f}",
+                f"{stats['latency_max']:.3f}",
+                f"{stats['bytes'] / 1024:.1f}",
+            )
+        console = Console()
+        console.print(table)
+        if summary["tokens"]:
+            console.print(f"[italic]Token events: {summary['tokens']}[/italic]")
+
+    def prometheus(self):
+        """
+        This method returns the metrics in the Prometheus text format
+        """
+        summary = self.summary()
+        lines = [
+            "# HELP fmc_api_request_duration_seconds Time waiting for FMC, by endpoint",
+            "# TYPE fmc_api_request_duration_seconds histogram",
+        ]
+        for stats in summary["endpoints"]:
+            labels = f'method="{stats["method"]}",endpoint="{stats["endpoint"]}"'
+            cumulative = 0
+            for bound, count in stats["buckets"].items():
+                cumulative += count
+                lines.append(f'fmc_api_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"fmc_api_request_duration_seconds_sum{{{labels}}} {stats['latency_sum']}")
+            lines.append(f"fmc_api_request_duration_seconds_count{{{labels}}} {stats['calls']}")
+        lines += ["# HELP fmc_api_requests_total Requests by endpoint and status code", "# TYPE fmc_api_requests_total counter"]
+        for stats in summary["endpoints"]:
+            for status, count in stats["status"].items():
+                lines.append(
+                    f'fmc_api_requests_total{{method="{stats["method"]}",endpoint="{stats["endpoint"]}",'
+                    f'status="{status}"}} {count}'
+                )
+        lines += ["# HELP fmc_api_retries_total Requests sent again after 429", "# TYPE fmc_api_retries_total counter"]
+        for stats in summary["endpoints"]:
+            lines.append(
+                f'fmc_api_retries_total{{method="{stats["method"]}",endpoint="{stats["endpoint"]}"}} {stats["retries"]}'
+            )
+        lines += ["# HELP fmc_api_response_bytes_total Bytes received by endpoint", "# TYPE fmc_api_response_bytes_total counter"]
+        for stats in summary["endpoints"]:
+            lines.append(
+                f'fmc_api_response_bytes_total{{method="{stats["method"]}",endpoint="{stats["endpoint"]}"}} {stats["bytes"]}'
+            )
+        lines += ["# HELP fmc_api_token_events_total Token generations, refreshes and invalid tokens", "# TYPE fmc_api_token_events_total counter"]
+        for event, count in summary["tokens"].items():
+            lines.append(f'fmc_api_token_events_total{{event="{event}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        This method writes the metrics to a file. Files ending in .prom or .txt use the Prometheus text format,
+        any other file is written as JSON
+        """
+        with open(path, "w") as metrics_file:
+            if path.endswith((".prom", ".txt")):
+                metrics_file.write(self.prometheus())
+            else:
+                metrics_file.write(json.dumps(self.summary(), indent=4))
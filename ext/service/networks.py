@@ -1,8 +1,8 @@
 import csv
+import ipaddress
 import json
 import re
 
-import requests
 from ext.service.hosts import get_hosts
 from ext.service.objects import add_network_object
 from rich import print as rprint
@@ -22,14 +22,77 @@ def get_networks(fmc):
     return response_data
 
 
-def get_host_network_id(fmc, address, network_list, host_list, fqdn_list):
+def is_ipv6(address):
     """
-    This method returns a JSON with all Hosts, networks and FQDNs objects created in a FMC
-    :return: response_data: List of Name and ID of every host, network of fqdn in FMC
+    This method checks if an address from the CSV file is an IPv6 Host or Network, ex: 2001:db8::1 or 2001:db8::/32
+    """
+    if ":" not in address:
+        return False
+    try:
+        return ipaddress.ip_network(address.strip(), strict=False).version == 6
+    except ValueError:
+        return False
+
+
+def get_address_type(address):
+    """
+    This method checks the format of an address from the CSV file to find out its object type
+    :return: Network, Host, FQDN or NetworkGroup
     """
     isAddress = bool(
         re.match("^\d+.\d+.\d+.\d+", address)
-    )  # Check if address has an IP Address format
+    ) or is_ipv6(address)  # Check if address has an IPv4 or IPv6 Address format
+    isFQDN = bool(
+        re.match(".*\..*", address)
+    )  # Check if address has a . (dot), indicating that it is FQDN
+
+    if isAddress:
+        if "/" in address:
+            return "Network"
+        return "Host"
+    elif isFQDN:
+        return "FQDN"
+    return "NetworkGroup"
+
+
+def network_object_data(address, address_type):
+    """
+    This method builds the JSON used to create a Host, Network or FQDN object for an address
+    :return: JSON Data of the object
+    """
+    if address_type == "FQDN":
+        name = address
+    else:
+        name = address.replace("/", "_")
+    return {
+        "name": name,
+        "description": address,
+        "type": address_type,
+        "value": address,
+    }
+
+
+def network_literal(address, address_type):
+    """
+    This method builds the literal used to write a Host or Network directly in an ACP Rule, without an object
+    :param address_type: Host or Network
+    :return: JSON Data of the literal
+    """
+    return {"type": address_type, "value": address}
+
+
+def get_host_network_id(
+    fmc, address, network_list, host_list, fqdn_list, group_list=None
+):
+    """
+    This method returns the ID and type of a host, network or FQDN. If the object does not exist, it is created and
+    added to the network_list/host_list/fqdn_list received, so the next lookups will find it
+    :param group_list: Network group list from FMC. If None, it is downloaded when the address is a group
+    :return: id, address_type: ID and type of the host, network or fqdn in FMC
+    """
+    isAddress = bool(
+        re.match("^\d+.\d+.\d+.\d+", address)
+    ) or is_ipv6(address)  # Check if address has an IPv4 or IPv6 Address format
     isFQDN = bool(
         re.match(".*\..*", address)
     )  # Check if address has a . (dot), indicating that it is FQDN
@@ -57,6 +120,8 @@ def get_host_network_id(fmc, address, network_list, host_list, fqdn_list):
                         f"[white]{json.dumps(status_network).replace('error','[red]error[/red]')}[/white]"
                     )
                 id = status_network[address]
+                if "error" not in json.dumps(status_network):
+                    network_list[address] = id
         else:
             address_type = "Host"
             try:
@@ -74,6 +139,8 @@ def get_host_network_id(fmc, address, network_list, host_list, fqdn_list):
                 }
                 status_network = add_network_object(fmc, "Host", network_json_data)
                 id = status_network[address]
+                if "error" not in json.dumps(status_network):
+                    host_list[address] = id
     # Otherwise, if the address has a dot in its name, it is a FQDN
     elif isFQDN:
         address_type = "FQDN"
@@ -92,10 +159,13 @@ def get_host_network_id(fmc, address, network_list, host_list, fqdn_list):
             }
             status_network = add_network_object(fmc, "FQDN", network_json_data)
             id = status_network[address]
+            if "error" not in json.dumps(status_network):
+                fqdn_list[address] = id
     # Otherwise, it is a group
     else:
         address_type = "NetworkGroup"
-        group_list = get_network_groups(fmc)
+        if group_list is None:
+            group_list = get_network_groups(fmc)
         id = group_list[address]
 
     return id, address_type
@@ -115,6 +185,18 @@ def get_network_groups(fmc):
     return response_data
 
 
+def get_network_groups_expanded(fmc):
+    """
+    This method returns every Network Group created in a FMC with its objects and literals, using paginated GETs
+    instead of one GET per group
+    :return: response_data: List with the JSON of every Network Group
+    """
+    path = "object/networkgroups?expanded=true&offset=0&limit=1000"
+    retorno_json_chave = ["all"]
+    response_data = fmc.get_information(path, retorno_json_chave)
+    return response_data
+
+
 def add_network_groups(fmc, group_name, address_list):
     """
     This method adds a single Network Group
@@ -196,15 +278,8 @@ def get_network_group_detail(fmc, group_id):
     """
     path = f"object/networkgroups/{group_id}"
     response_data = []
-    headers = {
-        "Content-Type": "application/json",
-        "X-auth-access-token": fmc.authtoken,
-        "X-auth-refresh-token": fmc.refreshtoken,
-    }
-    api_path = f"/api/fmc_config/v1/domain/{fmc.domain}/{path}"
-    url = "https://" + fmc.ipaddr + api_path
 
-    r = requests.get(url, headers=headers, verify=False)
+    r = fmc.request("GET", path)
     json_resp = json.loads(r.text)
     # For each element in the return of the GET...
     try:
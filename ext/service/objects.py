@@ -26,51 +26,64 @@ def add_network_object(fmc, object_type, json_data, domain_uuid=None):
     return response_data
 
 
+def add_network_objects_bulk(fmc, object_type, json_data, bulk_size=1000):
+    """
+    This method adds a list of objects of the same type (Host, Network or FQDN) with bulk POSTs.
+    If FMC rejects a bulk POST, the objects of that POST are added one by one, so each object gets its own status.
+    The objects that an accepted bulk POST did not return are added one by one too.
+    :param object_type: Host, Network or FQDN. Any other type raises ValueError
+    :param json_data: List of POST data
+    :param bulk_size: Maximum number of objects in each POST (FMC limit is 1000)
+    :return: response_data: Value and ID of each object, or Value and the error message
+    """
+    if object_type == "Host":
+        path = "object/hosts?bulk=true"
+    elif object_type == "Network":
+        path = "object/networks?bulk=true"
+    elif object_type == "FQDN":
+        path = "object/fqdns?bulk=true"
+    else:
+        raise ValueError(f"Unknown object type {object_type}")
+
+    retorno_json_chave = ["value"]
+    response_data = {}
+    for index in range(0, len(json_data), bulk_size):
+        chunk = json_data[index : index + bulk_size]
+        created, status = fmc.add_bulk_information(path, chunk, retorno_json_chave)
+        # Only the objects not returned by FMC (every object, if the POST was rejected) are sent again one by one
+        for object in chunk:
+            if not created or object["value"] not in status:
+                status.update(add_network_object(fmc, object_type, object))
+        response_data.update(status)
+    return response_data
+
+
 def add_network_objects_csv(fmc, csv_input):
     """
-    This method adds hosts, networks and FQDNs listed in a CSV File
+    This method adds hosts, networks and FQDNs listed in a CSV File. The file is read one line at a time and each
+    object is added as soon as it is read, so the memory used does not depend on the size of the file
     :param csv_input: CSV File with Name,Description,Type,Value
     :return: response_data: Array with the IP Address and ID of the host/network/fqdn created
     """
-    input_data = {}
     response_data = {}
 
     # Reading CSV file
     with open(csv_input, "r") as input_file:
         input_csv = csv.reader(input_file, delimiter=",")
         for object in input_csv:
-            # Skip header line and comments
-            if object[0].startswith("#"):
+            # Skip empty lines, header line and comments
+            if not object or object[0].startswith("#"):
                 continue
-            # Check the type of the object (host, network or FQDN) and build a JSON with the object type as
-            # key, and the array of elements as value.
-            if object[2] in input_data.keys():
-                input_data[object[2]].append(
-                    {
-                        "name": object[0],
-                        "description": object[1],
-                        "type": object[2],
-                        "value": object[3],
-                    }
-                )
-            else:
-                input_data[object[2]] = [
-                    {
-                        "name": object[0],
-                        "description": object[1],
-                        "type": object[2],
-                        "value": object[3],
-                    }
-                ]
-
-    # For each type of object (host, network, fqdn), add the objects
-    for object_type in input_data.keys():
-        # For each type object, we will have an array of objects. Let's loop this array to
-        # add each host individually. It is better than bulk to receive individual status for each object
-        for object in input_data[object_type]:
+            # Objects are added one by one. It is better than bulk to receive individual status for each object
+            json_data = {
+                "name": object[0],
+                "description": object[1],
+                "type": object[2],
+                "value": object[3],
+            }
             # Store the status in response_data dictionary
             response_data.update(
-                add_network_object(fmc, object_type, object, fmc.domain)
+                add_network_object(fmc, object[2], json_data, fmc.domain)
             )
 
     return response_data
@@ -0,0 +1,343 @@
+import json
+import threading
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlsplit
+
+from ext.service.acps import add_acp
+from ext.service.csv_stream import scan_tokens
+from ext.service.metrics import ID_IN_PATH
+from ext.service.rule_index import DUPLICATED
+from rich import print as rprint
+
+# IDs given to the objects that would be created. They look like FMC IDs, so they are handled the same way by the
+# rule index and the metrics, but they never exist in FMC
+PLANNED_ID_PREFIX = "00000000-0000-0000-0000-"
+# Kind of object created by each endpoint, used to list the objects in the plan
+CREATED_KINDS = {
+    "object/hosts": "hosts",
+    "object/networks": "networks",
+    "object/fqdns": "fqdns",
+    "object/protocolportobjects": "ports",
+    "object/networkgroups": "network_groups",
+    "object/portobjectgroups": "port_groups",
+    "policy/accesspolicies": "policies",
+    "policy/accesspolicies/{id}/categories": "categories",
+    "policy/accesspolicies/{id}/accessrules": "rules",
+}
+
+
+def endpoint(path):
+    """
+    This method returns the endpoint template of an API Path, ex: policy/accesspolicies/{id}/accessrules
+    """
+    return ID_IN_PATH.sub("/{id}", "/" + urlsplit(path).path)[1:]
+
+
+class PlannedResponse:
+    """
+    Answer of a request that was not sent to FMC. It has the attributes of a Response used by this application
+    """
+
+    def __init__(self, status_code, json_data):
+        self.status_code = status_code
+        self.text = json.dumps(json_data)
+        self.content = self.text.encode()
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+#################################################################################################
+# PLAN FMC
+#################################################################################################
+class PlanFMC:
+    """
+    Front end of the FMC class used by the dry run. The GETs are sent to FMC, so the lists and the rules are the real
+    ones, but every POST, PUT and DELETE is only recorded and answered as if FMC had accepted it, with a planned ID.
+    The GETs of objects that would be created during the run (ex: the Categories of a new Policy) are not sent either,
+    they are counted and answered with an empty list. This way add_acp runs exactly as it would, finding the same
+    objects, creating them only once and skipping the same rules, without changing FMC.
+    """
+
+    def __init__(self, fmc):
+        self.__fmc = fmc
+        self.__lock = threading.Lock()
+        self.__next_id = 0
+        # (method, endpoint) -> number of requests not sent to FMC
+        self.__calls = {}
+        # Kind -> elements that would be created, in the order they would be created
+        self.__created = {kind: [] for kind in CREATED_KINDS.values()}
+        # Planned ID -> name of the planned element, and ACP Policy ID -> name of the existing Policies
+        self.__names = {}
+        # Names of the Network Groups and Port Groups found in FMC
+        self.__groups = {"object/networkgroups": set(), "object/portobjectgroups": set()}
+
+    @property
+    def fmc(self):
+        return self.__fmc
+
+    @property
+    def ipaddr(self):
+        return self.__fmc.ipaddr
+
+    @property
+    def domain(self):
+        return self.__fmc.domain
+
+    @property
+    def rate_limiter(self):
+        return self.__fmc.rate_limiter
+
+    @property
+    def metrics(self):
+        return self.__fmc.metrics
+
+    @property
+    def calls(self):
+        """
+        (method, endpoint) -> number of requests that were not sent to FMC
+        """
+        with self.__lock:
+            return dict(self.__calls)
+
+    @property
+    def created(self):
+        return self.__created
+
+    def groups(self, path):
+        """
+        :param path: object/networkgroups or object/portobjectgroups
+        :return: Names of the groups found in FMC
+        """
+        return self.__groups[path]
+
+    def name(self, id):
+        return self.__names.get(id, id)
+
+    def is_planned(self, id):
+        return str(id).startswith(PLANNED_ID_PREFIX)
+
+    def __planned_id(self, name):
+        with self.__lock:
+            self.__next_id += 1
+            id = f"{PLANNED_ID_PREFIX}{self.__next_id:012d}"
+            self.__names[id] = name
+        return id
+
+    def __count(self, method, path):
+        with self.__lock:
+            key = (method, endpoint(path))
+            self.__calls[key] = self.__calls.get(key, 0) + 1
+
+    def __create(self, path, element):
+        # Planned ID of an element, recorded as created with the names of the Policy and Category it is added to
+        kind = CREATED_KINDS.get(endpoint(path))
+        if element.get("type") == "ProtocolPortObject":
+            name = f"{element['port']}/{element['protocol']}"
+        else:
+            name = element.get("value", element.get("name"))
+        entry = {"name": name, "type": element.get("type")}
+        if kind in ("categories", "rules"):
+            entry["policy"] = self.name(urlsplit(path).path.split("/")[2])
+        if kind == "rules":
+            entry["category"] = dict(parse_qsl(urlsplit(path).query)).get("category")
+        if kind in ("network_groups", "port_groups"):
+            entry["members"] = len(element.get("objects", [])) + len(element.get("literals", []))
+        if kind is not None:
+            with self.__lock:
+                self.__created[kind].append(entry)
+        return dict(element, id=self.__planned_id(element.get("name")))
+
+    def request(self, method, path, json_data=None):
+        """
+        This method sends the GETs to FMC and records the other requests
+        :return: Response, or PlannedResponse if the request was not sent
+        """
+        if method == "GET" and PLANNED_ID_PREFIX not in path:
+            return self.__fmc.request(method, path, json_data)
+        self.__count(method, path)
+        if method == "GET":
+            return PlannedResponse(200, {"items": [], "paging": {"count": 0, "pages": 0}})
+        if method == "POST":
+            if isinstance(json_data, list):
+                return PlannedResponse(201, {"items": [self.__create(path, element) for element in json_data]})
+            return PlannedResponse(201, self.__create(path, json_data))
+        return PlannedResponse(200, {})
+
+    def get_information(self, path, retorno_json_chave):
+        if PLANNED_ID_PREFIX in path:
+            self.__count("GET", path)
+            return [] if retorno_json_chave[0] == "all" else {}
+        response_data = self.__fmc.get_information(path, retorno_json_chave)
+        # The Policy names are kept to write the plan, and the group names to check the groups of the CSV file
+        if endpoint(path) == "policy/accesspolicies":
+            self.__names.update({id: name for name, id in response_data.items()})
+        elif endpoint(path) in self.__groups and retorno_json_chave[0] == "all":
+            self.__groups[endpoint(path)].update(group["name"] for group in response_data)
+        elif endpoint(path) in self.__groups:
+            self.__groups[endpoint(path)].update(response_data)
+        return response_data
+
+    def add_information(self, path, json_data, retorno_json_chave):
+        r = self.request("POST", path, json_data)
+        element = json.loads(r.text)
+        if retorno_json_chave[0] == "port":
+            return {f"{element['port']}/{element['protocol']}": element["id"]}
+        return {json_data[retorno_json_chave[0]]: element["id"]}
+
+    def add_bulk_information(self, path, json_data, retorno_json_chave):
+        r = self.request("POST", path, json_data)
+        response_data = {}
+        for element in json.loads(r.text)["items"]:
+            if retorno_json_chave[0] == "port":
+                response_data[f"{element['port']}/{element['protocol']}"] = element["id"]
+            else:
+                response_data[element[retorno_json_chave[0]]] = element["id"]
+        return True, response_data
+
+    def delete_information(self, id, path):
+        self.__count("DELETE", path)
+        return {}
+
+
+#################################################################################################
+# PLAN
+#################################################################################################
+def _sent_calls(fmc):
+    # (method, endpoint) -> (calls, total latency) of the requests already sent to FMC
+    return {
+        (stats["method"], stats["endpoint"]): (stats["calls"], stats["latency_sum"])
+        for stats in fmc.metrics.summary()["endpoints"]
+    }
+
+
+def estimate_time(calls, rate, period, latency, concurrency=0):
+    """
+    This method estimates how long a run takes. The rate limiter sends at most `rate` requests in any window of
+    `period` seconds, so request number N (from 0) is sent at least N // rate periods after the first one, and each
+    request waits for FMC (or `concurrency` requests at a time)
+    :param calls: Number of requests
+    :param latency: Average seconds waiting for FMC in each request
+    :return: Dict with the time spent waiting for the rate limit, for FMC and the estimated total, in seconds
+    """
+    rate_limit_seconds = (calls - 1) // rate * period if calls > 0 else 0
+    latency_seconds = calls * latency / max(1, concurrency)
+    seconds = max(rate_limit_seconds, latency_seconds)
+    return {
+        "rate_limit_seconds": round(rate_limit_seconds, 1),
+        "latency_seconds": round(latency_seconds, 1),
+        "seconds": round(seconds, 1),
+        "duration": str(timedelta(seconds=round(seconds))),
+    }
+
+
+def plan_acp(fmc, csv_input, concurrency=0, inventory=None, **acp_options):
+    """
+    This method runs add_acp without changing FMC and returns what it would do: the objects, groups, Policies and
+    Categories it would create, the rules it would add or skip and the number of API calls of each endpoint. The
+    lists, groups and rules are read from FMC with the same GETs of the real run, so the plan uses the current
+    objects of FMC. The plan assumes that every POST is accepted, so the calls sent again one by one after a bulk
+    POST is rejected are not counted.
+    :param csv_input: CSV File
+    :param concurrency: Requests sent at the same time in the real run, used only to estimate the time
+    :param inventory: Not used. The run would save the planned IDs in the inventory, so the lists are read from FMC
+    :param acp_options: Same options of add_acp (bulk_size, bulk_objects, skip_existing, ...)
+    :return: Dict with the plan
+    """
+    plan_fmc = PlanFMC(fmc)
+    sent_before = _sent_calls(fmc)
+    rule_status = add_acp(plan_fmc, csv_input, **acp_options)
+    sent_after = _sent_calls(fmc)
+
+    # Calls of each endpoint. The GETs sent during the plan are the GETs of the real run
+    api_calls = {}
+    reads_latency = 0.0
+    for key, (calls, latency_sum) in sent_after.items():
+        calls_before, latency_before = sent_before.get(key, (0, 0.0))
+        if calls > calls_before:
+            api_calls[key] = calls - calls_before
+            reads_latency += latency_sum - latency_before
+    for key, calls in plan_fmc.calls.items():
+        api_calls[key] = api_calls.get(key, 0) + calls
+    reads = sum(calls for (method, path), calls in api_calls.items() if method == "GET")
+    writes = sum(api_calls.values()) - reads
+
+    # Rules that would be added, and the status of the other lines: added by the rule of another line (joined by the
+    # rule aggregation or with the same traffic), already in FMC (or repeated in the CSV file) or error
+    rules = {"add": plan_fmc.created["rules"], "joined": {}, "skip": {}, "errors": {}}
+    for name, status in rule_status.items():
+        if plan_fmc.is_planned(status):
+            if plan_fmc.name(status) != name:
+                rules["joined"][name] = plan_fmc.name(status)
+        elif " " not in status or status.startswith(DUPLICATED):
+            rules["skip"][name] = status
+        else:
+            rules["errors"][name] = status
+
+    # Groups used in the CSV file that do not exist in FMC. The rules are added without them
+    problems = []
+    tokens = scan_tokens(csv_input, acp_options.get("row_filter"))
+    network_groups = plan_fmc.groups("object/networkgroups")
+    for group in tokens.networks("NetworkGroup"):
+        if group not in network_groups:
+            problems.append(f"Network Group {group} does not exist")
+    port_groups = plan_fmc.groups("object/portobjectgroups")
+    for port in tokens.ports():
+        if "/" not in port and port not in port_groups:
+            problems.append(f"Port Group {port} does not exist")
+    problems += [f"Rule {name}: {status}" for name, status in rules["errors"].items()]
+
+    rate_limiter = fmc.rate_limiter
+    calls = reads + writes
+    latency = reads_latency / reads if reads else 0.0
+    plan = {
+        "csv": csv_input,
+        "fmc": fmc.ipaddr,
+        "domain": fmc.domain,
+        "options": {
+            key: value for key, value in acp_options.items() if key != "row_filter"
+        },
+        "create": {
+            kind: elements for kind, elements in plan_fmc.created.items() if kind != "rules"
+        },
+        "rules": rules,
+        "problems": problems,
+        "api_calls": {
+            "reads": reads,
+            "writes": writes,
+            "total": calls,
+            "endpoints": {
+                f"{method} {path}": count for (method, path), count in sorted(api_calls.items())
+            },
+        },
+        "time": dict(
+            estimate_time(
+                calls, rate_limiter.rate, rate_limiter.period, latency, concurrency
+            ),
+            rate_limit=f"{rate_limiter.rate}/{rate_limiter.period}s",
+            average_latency=round(latency, 3),
+        ),
+    }
+    return plan
+
+
+def print_plan(plan):
+    """
+    This method prints the summary of a plan
+    """
+    rprint("\n[green]Dry run completed. Nothing was changed in FMC:[/green]")
+    for kind, elements in plan["create"].items():
+        if elements:
+            rprint(f"[italic]{kind}: {len(elements)} to create[/italic]")
+    rprint(
+        f"[italic]Rules: {len(plan['rules']['add'])} to add, {len(plan['rules']['joined'])} lines joined in "
+        f"other rules, {len(plan['rules']['skip'])} to skip, {len(plan['rules']['errors'])} with errors[/italic]"
+    )
+    for problem in plan["problems"]:
+        rprint(f"[red]{problem}[/red]")
+    api_calls = plan["api_calls"]
+    rprint(
+        f"[yellow]API calls: {api_calls['total']} ({api_calls['reads']} GETs and {api_calls['writes']} writes). "
+        f"Estimated time: {plan['time']['duration']} at {plan['time']['rate_limit']}[/yellow]"
+    )
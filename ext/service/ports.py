@@ -1,3 +1,8 @@
+import json
+
+# IP protocol numbers used by the port literals
+PROTOCOL_NUMBERS = {"TCP": "6", "UDP": "17"}
+
 #################################################################################################
 # PORTS
 #################################################################################################
@@ -18,6 +23,23 @@ def get_ports(fmc):
     return response_data
 
 
+def port_literal(port_protocol):
+    """
+    This method builds the literal used to write a port directly in an ACP Rule, without an object
+    :param port_protocol: <PORTNUMBER>/<PROTOCOL> or <FIRST>-<LAST>/<PROTOCOL>, ex: 443/TCP or 1024-2048/UDP. For
+    ICMP, the port is the ICMP type, ex: 8/ICMP
+    :return: JSON Data of the literal
+    """
+    port, protocol = port_protocol.split("/")
+    if protocol.upper() == "ICMP":
+        return {"type": "ICMPv4PortLiteral", "protocol": "1", "icmpType": port}
+    return {
+        "type": "PortLiteral",
+        "port": port,
+        "protocol": PROTOCOL_NUMBERS.get(protocol.upper(), protocol),
+    }
+
+
 def get_port_groups(fmc):
     """
     This method gets the ports objects created in this FMC
@@ -30,15 +52,29 @@ def get_port_groups(fmc):
     return response_data
 
 
-def add_ports(fmc, port, protocol):
+def find_port(fmc, port, protocol):
     """
-    This method gets the ports objects created in this FMC
-    :return: response_data: List of Ports and ID of every FTD Device in FMC
+    This method searches a single port in FMC, without downloading the whole list of ports
+    :return: ID of the port, or None if it does not exist
+    """
+    path = f"object/protocolportobjects?filter=nameOrValue:{port}&expanded=true&offset=0&limit=1000"
+    retorno_json_chave = ["port", "protocol"]
+    response_data = fmc.get_information(path, retorno_json_chave)
+    return response_data.get(f"{port}/{protocol}")
+
+
+def add_ports(fmc, port, protocol, port_list=None):
+    """
+    This method adds a port, if it does not exist yet
+    :param port_list: Ports list already downloaded from FMC. It is trusted to check if the port exists, and the new
+    port is added to it. If None, the whole list of ports is downloaded from FMC
+    :return: response_data: <PORTNUMBER>/<PROTOCOL> and ID of the port, or <PORTNUMBER>/<PROTOCOL> and the error message
     """
     response_data = {}
 
     # Check if the port exists. If it does, return the port/protocol and ID
-    port_list = get_ports(fmc)
+    if port_list is None:
+        port_list = get_ports(fmc)
     port_protocol = f"{port}/{protocol}"
     if port_protocol in port_list.keys():
         response_data = {port_protocol: port_list[port_protocol]}
@@ -55,4 +91,48 @@ def add_ports(fmc, port, protocol):
     retorno_json_chave = ["port", "protocol"]
     response_data = fmc.add_information(path, post_data, retorno_json_chave)
 
+    # If it was created by someone else after the list was downloaded, search only this port to get its ID
+    if "already exists" in json.dumps(response_data):
+        port_id = find_port(fmc, port, protocol)
+        if port_id is not None:
+            response_data = {port_protocol: port_id}
+
+    # Keep the list updated, so the next lookups will find this port
+    if "error" not in json.dumps(response_data):
+        port_list[port_protocol] = response_data[port_protocol]
+    return response_data
+
+
+def add_ports_bulk(fmc, port_list, bulk_size=1000):
+    """
+    This method adds a list of ports with bulk POSTs.
+    If FMC rejects a bulk POST, the ports of that POST are added one by one, so each port gets its own status.
+    The ports that an accepted bulk POST did not return are added one by one too.
+    :param port_list: List of ports in the format <PORTNUMBER>/<PROTOCOL>, ex: 443/TCP
+    :param bulk_size: Maximum number of ports in each POST (FMC limit is 1000)
+    :return: response_data: <PORTNUMBER>/<PROTOCOL> and ID of each port, or <PORTNUMBER>/<PROTOCOL> and the error message
+    """
+    path = "object/protocolportobjects?bulk=true"
+    retorno_json_chave = ["port", "protocol"]
+    response_data = {}
+    for index in range(0, len(port_list), bulk_size):
+        chunk = port_list[index : index + bulk_size]
+        post_data = []
+        for port_protocol in chunk:
+            port, protocol = port_protocol.split("/")
+            post_data.append(
+                {
+                    "name": f"{port}_{protocol}",
+                    "protocol": protocol,
+                    "port": port,
+                    "type": "ProtocolPortObject",
+                }
+            )
+        created, status = fmc.add_bulk_information(path, post_data, retorno_json_chave)
+        # Only the ports not returned by FMC (every port, if the POST was rejected) are sent again one by one
+        for port_protocol in chunk:
+            if not created or port_protocol not in status:
+                port, protocol = port_protocol.split("/")
+                status.update(add_ports(fmc, port, protocol, {}))
+        response_data.update(status)
     return response_data
@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import deque
+
+
+#################################################################################################
+# RATE LIMIT
+#################################################################################################
+class RateLimiter:
+    """
+    Sliding window used to pace the requests sent to FMC. FMC accepts about 120 requests per minute per user, so at
+    most `rate` requests are sent in any window of `period` seconds: the send time of the last `rate` requests is
+    kept, and a new request waits until the oldest of them is `period` seconds old. It is thread safe, so parallel
+    workers share one budget.
+    """
+
+    def __init__(self, rate=120, period=60):
+        self.__rate = rate
+        self.__period = period
+        # Send time of the requests of the current window, oldest first
+        self.__sent = deque()
+        self.__paused_until = 0.0
+        self.__requests = 0
+        self.__throttled = 0
+        self.__waited = 0.0
+        self.__lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self.__rate
+
+    @property
+    def period(self):
+        return self.__period
+
+    def __expire(self, now):
+        # Forget the requests that left the window
+        while self.__sent and now - self.__sent[0] >= self.__period:
+            self.__sent.popleft()
+
+    def acquire(self):
+        """
+        This method blocks until a request can be sent without going over the rate limit
+        """
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__expire(now)
+                if now >= self.__paused_until and len(self.__sent) < self.__rate:
+                    self.__sent.append(now)
+                    self.__requests += 1
+                    return
+                # Time until the pause ends or the oldest request leaves the window
+                wait = self.__paused_until - now
+                if len(self.__sent) >= self.__rate:
+                    wait = max(wait, self.__sent[0] + self.__period - now)
+                self.__waited += wait
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        This method stops every request for some seconds. It is used when FMC answers 429 with a Retry-After header
+        :param seconds: Seconds to wait before the next request
+        """
+        with self.__lock:
+            self.__throttled += 1
+            self.__paused_until = max(self.__paused_until, time.monotonic() + seconds)
+
+    def usage(self):
+        """
+        This method returns the current usage of the request budget
+        :return: Dict with the limit, the requests that can be sent now, the requests sent, the number of 429
+        received and the total time spent waiting
+        """
+        with self.__lock:
+            self.__expire(time.monotonic())
+            return {
+                "limit": f"{self.__rate}/{self.__period}s",
+                "available": self.__rate - len(self.__sent),
+                "requests": self.__requests,
+                "throttled": self.__throttled,
+                "waited": round(self.__waited, 2),
+            }
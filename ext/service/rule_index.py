@@ -0,0 +1,163 @@
+import hashlib
+import json
+import threading
+
+# Status of a CSV line that repeats another line of the same run, while the first one is not sent
+DUPLICATED = "Duplicated line in the CSV file"
+
+# Fields of an ACP Rule that define the traffic it matches. The name, category and logging are not compared
+RULE_FIELDS = (
+    "sourceZones",
+    "destinationZones",
+    "sourceNetworks",
+    "destinationNetworks",
+    "sourcePorts",
+    "destinationPorts",
+)
+# Conditions that the CSV file can't set. A rule with any of them matches other traffic than the CSV lines
+UNINDEXED_FIELDS = ("applications", "urls", "users", "vlanTags")
+
+
+#################################################################################################
+# RULE INDEX
+#################################################################################################
+class RuleIndex:
+    """
+    Index of the ACP Rules that already exist in each ACP Policy, so the CSV lines already in FMC are skipped
+    without a POST. The rules of a Policy are downloaded once (expanded), the first time the Policy is used, and
+    indexed by name and by a hash of the action, state, zones, networks and ports. The rules with applications,
+    URLs, users or VLAN tags are only indexed by name. The rules added during the run are indexed too, so repeated
+    CSV lines are also detected: they get the status of the first line, in single and in bulk mode.
+    """
+
+    def __init__(self, fmc):
+        self.__fmc = fmc
+        self.__lock = threading.Lock()
+        self.__policy_locks = {}
+        # ACP Policy ID -> {rule name: (rule hash, rule ID)}
+        self.__names = {}
+        # ACP Policy ID -> {rule hash: (rule name, rule ID)}
+        self.__hashes = {}
+        # ACP Policy ID -> {queued rule name: names of the rules that repeat it}
+        self.__duplicates = {}
+
+    @staticmethod
+    def rule_hash(rule):
+        """
+        This method returns the hash of the traffic matched by a rule. The same hash is returned for the JSON sent
+        to FMC and for the expanded JSON returned by FMC
+        :param rule: JSON of the ACP Rule
+        :return: The hash, or None if the rule has conditions that are not compared
+        """
+        if any(rule.get(field) for field in UNINDEXED_FIELDS):
+            return None
+        canonical = {
+            "action": rule.get("action", "").upper(),
+            "enabled": rule.get("enabled", False),
+        }
+        for field in RULE_FIELDS:
+            value = rule.get(field, {})
+            objects = sorted(element["id"] for element in value.get("objects", []))
+            literals = sorted(
+                json.dumps(element, sort_keys=True)
+                for element in value.get("literals", [])
+            )
+            if objects or literals:
+                canonical[field] = [objects, literals]
+        return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+    def __policy_lock(self, policy_id):
+        with self.__lock:
+            return self.__policy_locks.setdefault(policy_id, threading.Lock())
+
+    def load(self, policy_id):
+        """
+        This method downloads the rules of a Policy, if they were not downloaded yet
+        :param policy_id: ACP Policy ID
+        """
+        if policy_id in self.__names:
+            return
+        # Only one worker downloads the rules of a Policy. The others wait and reuse them
+        with self.__policy_lock(policy_id):
+            if policy_id in self.__names:
+                return
+            path = f"policy/accesspolicies/{policy_id}/accessrules?expanded=true&offset=0&limit=1000"
+            names = {}
+            hashes = {}
+            for rule in self.__fmc.get_information(path, ["all"]):
+                rule_hash = self.rule_hash(rule)
+                names[rule["name"]] = (rule_hash, rule["id"])
+                if rule_hash is not None:
+                    hashes.setdefault(rule_hash, (rule["name"], rule["id"]))
+            with self.__lock:
+                self.__hashes[policy_id] = hashes
+                self.__names[policy_id] = names
+
+    def new_policy(self, policy_id):
+        """
+        This method is called when a Policy is created during the run, so its (empty) rules are not downloaded
+        """
+        with self.__lock:
+            self.__names.setdefault(policy_id, {})
+            self.__hashes.setdefault(policy_id, {})
+
+    def check(self, policy_id, post_data):
+        """
+        This method checks if a rule must be sent to FMC
+        :param post_data: JSON of the ACP Rule
+        :return: None if the rule must be added. Otherwise, the status of the rule: the ID of the rule that already
+        matches the same traffic, or an error message if another rule already has this name. If the same traffic is
+        matched by a rule queued and not sent yet, a temporary message is returned and update sets the status of the
+        queued rule
+        """
+        self.load(policy_id)
+        rule_hash = self.rule_hash(post_data)
+        with self.__lock:
+            existing = self.__names[policy_id].get(post_data["name"])
+            same_traffic = self.__hashes[policy_id].get(rule_hash)
+        if existing is not None:
+            if existing[0] != rule_hash:
+                return "A rule with this name and different networks, ports, zones or action already exists"
+            return existing[1] or DUPLICATED
+        if same_traffic is not None:
+            if same_traffic[1] is None:
+                with self.__lock:
+                    self.__duplicates.setdefault(policy_id, {}).setdefault(
+                        same_traffic[0], []
+                    ).append(post_data["name"])
+                return f"{DUPLICATED} (same as rule {same_traffic[0]})"
+            return same_traffic[1]
+        return None
+
+    def add(self, policy_id, post_data, id=None):
+        """
+        This method indexes a rule queued or added during the run
+        :param id: ID of the rule, or None if it was not sent yet
+        """
+        rule_hash = self.rule_hash(post_data)
+        with self.__lock:
+            self.__names.setdefault(policy_id, {})[post_data["name"]] = (rule_hash, id)
+            if rule_hash is not None:
+                self.__hashes.setdefault(policy_id, {})[rule_hash] = (post_data["name"], id)
+
+    def update(self, policy_id, rules, status):
+        """
+        This method saves the IDs of the rules sent to FMC, or removes the rules that were not added. The rules that
+        repeat a rule sent get its status
+        :param rules: List of JSON of the ACP Rules sent
+        :param status: Rule name and ID, or Rule name and the error message. The repeated rules are added to it
+        """
+        for post_data in rules:
+            id = status.get(post_data["name"])
+            with self.__lock:
+                repeated = self.__duplicates.get(policy_id, {}).pop(post_data["name"], [])
+            for name in repeated:
+                status[name] = id if id is not None else "Rule was not added"
+            if id is not None and " " not in id:
+                self.add(policy_id, post_data, id)
+                continue
+            rule_hash = self.rule_hash(post_data)
+            with self.__lock:
+                self.__names[policy_id].pop(post_data["name"], None)
+                if self.__hashes[policy_id].get(rule_hash, (None,))[0] == post_data["name"]:
+                    del self.__hashes[policy_id][rule_hash]
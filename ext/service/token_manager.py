@@ -0,0 +1,97 @@
+import threading
+import time
+
+from ext.service.connection import make_connection, refresh_token
+from rich import print as rprint
+
+# FMC access tokens are valid for 30 minutes and can be refreshed 3 times. After that, a new token must be generated
+TOKEN_LIFETIME = 1800
+MAX_REFRESHES = 3
+
+
+#################################################################################################
+# TOKEN MANAGER
+#################################################################################################
+class TokenManager:
+    """
+    Keeps the access token of a FMC object valid. It tracks when the token was issued and how many times it was
+    refreshed, refreshes it `margin` seconds before it expires and generates a new one after the refresh limit.
+    A lock makes sure only one worker renews the token, while the others wait and reuse the new token.
+    """
+
+    def __init__(self, fmc, lifetime=TOKEN_LIFETIME, margin=300):
+        self.__fmc = fmc
+        self.__lifetime = lifetime
+        self.__margin = margin
+        self.__issued = None
+        self.__refreshes = 0
+        self.__lock = threading.RLock()
+
+    @property
+    def refreshes(self):
+        return self.__refreshes
+
+    def age(self):
+        """
+        This method returns how many seconds ago the current token was issued, or None if there is no token
+        """
+        if self.__issued is None:
+            return None
+        return time.monotonic() - self.__issued
+
+    def authenticate(self):
+        """
+        This method generates a new token with the username and password
+        :return: domain_list: Domains returned by FMC
+        """
+        with self.__lock:
+            auth_token, refresh_token, domain_list = make_connection(self.__fmc)
+            self.__fmc.metrics.record_token("generate")
+            self.__fmc.authtoken = auth_token
+            self.__fmc.refreshtoken = refresh_token
+            self.__issued = time.monotonic()
+            self.__refreshes = 0
+            return domain_list
+
+    def ensure_valid(self):
+        """
+        This method is called before each request. It renews the token if it is about to expire
+        """
+        age = self.age()
+        if age is not None and age < self.__lifetime - self.__margin:
+            return
+        with self.__lock:
+            # Another worker may have renewed the token while we were waiting for the lock
+            age = self.age()
+            if age is None or age >= self.__lifetime - self.__margin:
+                self.__renew()
+
+    def invalidate(self, auth_token):
+        """
+        This method is called when FMC says that a token is not valid. The token is renewed only if nobody renewed
+        it since the failed request was sent
+        :param auth_token: Token used in the failed request
+        """
+        with self.__lock:
+            if self.__fmc.authtoken == auth_token:
+                self.__renew()
+
+    def __renew(self):
+        # Use a refresh while FMC still allows it. Otherwise (or if there is no token yet), authenticate again
+        if self.__issued is None or self.__refreshes >= MAX_REFRESHES:
+            rprint("[italic]Generating a new token . . .[/italic]")
+            self.authenticate()
+            return
+        auth_token, refreshtoken, refreshed = refresh_token(
+            self.__fmc, self.__fmc.authtoken, self.__fmc.refreshtoken
+        )
+        self.__fmc.authtoken = auth_token
+        self.__fmc.refreshtoken = refreshtoken
+        self.__issued = time.monotonic()
+        # If FMC generated a new token instead, it can be refreshed 3 times again
+        if refreshed:
+            self.__fmc.metrics.record_token("refresh")
+            self.__refreshes += 1
+        else:
+            self.__fmc.metrics.record_token("generate")
+            self.__refreshes = 0
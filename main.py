@@ -1,3 +1,5 @@
+import asyncio
+import os
 import sys
 from datetime import datetime
 from getpass import getpass
@@ -6,9 +8,15 @@ from rich import print as rprint
 from rich.console import Console
 
 
-from ext.service.domains import get_domains
+from ext.service.domains import add_acp_domains, get_csv_domains, get_domains
+from ext.service.fan_out import add_acp_fmcs, get_journal_path, print_report
 from ext.service.FMC import *
 from ext.service.acps import add_acp
+from ext.service.AsyncFMC import AsyncFMC
+from ext.service.async_acps import add_acp_async
+from ext.service.inventory import Inventory
+from ext.service.journal import Journal
+from ext.service.plan import plan_acp, print_plan
 
 console = Console()
 DATE_TIME = "%D - %H:%M:%S: "
@@ -17,9 +25,11 @@ DATE_TIME = "%D - %H:%M:%S: "
 try:
     with open("ext/config/fmc_info.json", "r") as fmc_info:
         fmc_info_json = json.load(fmc_info)
-    fmc_ip = fmc_info_json["fmc_ip"]
-    fmc_user = fmc_info_json["fmc_user"]
-    fmc_passwd = fmc_info_json["fmc_passwd"]
+    # In multi FMC mode, the FMCs are listed in "fmcs" instead (see README)
+    if "fmcs" not in fmc_info_json:
+        fmc_ip = fmc_info_json["fmc_ip"]
+        fmc_user = fmc_info_json["fmc_user"]
+        fmc_passwd = fmc_info_json["fmc_passwd"]
 except:
     rprint("[red]fmc_info.json file not found![/red]")
     fmc_ip = input("FMC IP Address: ")
@@ -28,6 +38,11 @@ except:
     fmc_info_json = {"fmc_ip": fmc_ip, "fmc_user": fmc_user, "fmc_passwd": fmc_passwd}
     with open("ext/config/fmc_info.json", "w") as fmc_info:
         fmc_info.write(json.dumps(fmc_info_json))
+# Optional settings of the ACP creation (see README)
+acp_options = dict(fmc_info_json.get("acp_options", {}))
+# Optional local inventory of the FMC lists (see README)
+if "inventory" in fmc_info_json:
+    acp_options["inventory"] = Inventory(**fmc_info_json["inventory"])
 
 
 def bulk_add_acps(fmc):
@@ -36,13 +51,122 @@ def bulk_add_acps(fmc):
     console.input("[yellow]Please make sure you have a [bold]acp.csv[/bold] file in the Root directory. Press <ENTER> to continue...[/yellow]")
     file = "acp.csv"
     rprint(f"[yellow]{datetime.now().strftime(DATE_TIME)} Starting...[/yellow]")
+    # Dry run: nothing is changed in FMC and the plan of the run is saved in a file (see README)
+    if fmc_info_json.get("dry_run", False):
+        if "domains" in fmc_info_json:
+            rprint("[red]The dry run is not available in multi domain mode![/red]")
+            return
+        rprint("[italic]Planning Access Policies . . .[/italic]")
+        plan = plan_acp(
+            fmc, file, concurrency=fmc_info_json.get("concurrency", 0), **acp_options
+        )
+        plan_file = fmc_info_json.get("plan_file", f"{file}.plan.json")
+        with open(plan_file, "w") as output_file:
+            output_file.write(json.dumps(plan, indent=4))
+        print_plan(plan)
+        rprint(f"[italic]Plan saved in {plan_file}[/italic]")
+        return
+    # Multi domain mode: the lines are added to the domains listed in the config file or in the Domain column
+    multi_domain = "domains" in fmc_info_json
+    # Optional journal, used to resume an interrupted run (see README). There is one journal per domain
+    journals = {}
+    if fmc_info_json.get("journal", False):
+        if multi_domain:
+            domain_names = dict.fromkeys(fmc_info_json["domains"] + get_csv_domains(file))
+            journal_paths = {
+                domain_name: f"{file}.{domain_name.replace('/', '_')}.journal"
+                for domain_name in domain_names
+            }
+        else:
+            journal_paths = {None: f"{file}.journal"}
+        resume = False
+        if any(os.path.exists(journal_path) for journal_path in journal_paths.values()):
+            answer = console.input(
+                "[yellow]Found the journal of a previous run. Resume it? (y/n) [/yellow]"
+            )
+            resume = answer.strip().lower().startswith("y")
+        journals = {
+            domain_name: Journal(journal_path, resume)
+            for domain_name, journal_path in journal_paths.items()
+        }
     rprint("[italic]Adding Access Policies . . .[/italic]")
-    status = add_acp(fmc, file)
+    concurrency = fmc_info_json.get("concurrency", 0)
+    if multi_domain:
+        status = add_acp_domains(
+            fmc,
+            file,
+            fmc_info_json["domains"],
+            workers=fmc_info_json.get("domain_workers", 4),
+            concurrency=concurrency,
+            journals=journals,
+            **acp_options,
+        )
+    elif concurrency > 0:
+        status = asyncio.run(
+            add_acp_async(
+                AsyncFMC(fmc, concurrency), file, journal=journals.get(None), **acp_options
+            )
+        )
+    else:
+        status = add_acp(fmc, file, journal=journals.get(None), **acp_options)
+    for journal in journals.values():
+        journal.close()
     rprint("\n[green]Operation completed. Check the results below:[/green]")
     print(json.dumps(status, sort_keys=True, indent=4, separators=(",", ": ")))
+    rprint(f"[italic]API budget usage: {fmc.rate_limiter.usage()}[/italic]")
+    fmc.metrics.print_summary()
+    # Optional file with the metrics of every FMC endpoint (see README)
+    if "metrics_file" in fmc_info_json:
+        fmc.metrics.dump(fmc_info_json["metrics_file"])
+        rprint(f"[italic]API metrics saved in {fmc_info_json['metrics_file']}[/italic]")
 
 
-# Instantiating FMC object
-fmc = FMC(fmc_ip, fmc_user, fmc_passwd)
-fmc = get_domains(fmc)
-bulk_add_acps(fmc)
+def bulk_add_acps_fmcs():
+    console = Console()
+    console.input("[yellow]Please make sure you have the CSV files in the Root directory. Press <ENTER> to continue...[/yellow]")
+    file = "acp.csv"
+    targets = fmc_info_json["fmcs"]
+    rprint(f"[yellow]{datetime.now().strftime(DATE_TIME)} Starting {len(targets)} FMCs...[/yellow]")
+    resume = False
+    if fmc_info_json.get("journal", False) and any(
+        os.path.exists(get_journal_path(target, file)) for target in targets
+    ):
+        answer = console.input(
+            "[yellow]Found the journal of a previous run. Resume it? (y/n) [/yellow]"
+        )
+        resume = answer.strip().lower().startswith("y")
+    config = {key: value for key, value in fmc_info_json.items() if key != "fmcs"}
+    results = add_acp_fmcs(
+        targets, config, file, processes=fmc_info_json.get("processes", 4), resume=resume
+    )
+    rprint("\n[green]Operation completed. Check the results below:[/green]")
+    status = {result["name"]: result.get("status", "failed") for result in results}
+    print(json.dumps(status, sort_keys=True, indent=4, separators=(",", ": ")))
+    print_report(results)
+    # Optional file with the results, timings and metrics of every FMC (see README)
+    if "report_file" in fmc_info_json:
+        with open(fmc_info_json["report_file"], "w") as report_file:
+            report_file.write(json.dumps(results, indent=4))
+        rprint(f"[italic]Report saved in {fmc_info_json['report_file']}[/italic]")
+
+
+# The worker processes of the multi FMC mode import this file again on Windows and macOS, so the run is guarded
+if __name__ == "__main__":
+    # Multi FMC mode: each FMC is configured by its own worker process
+    if "fmcs" in fmc_info_json:
+        bulk_add_acps_fmcs()
+        sys.exit()
+
+    # Instantiating FMC object
+    fmc = FMC(
+        fmc_ip,
+        fmc_user,
+        fmc_passwd,
+        pool_size=fmc_info_json.get("pool_size", 10),
+        rate_limit=fmc_info_json.get("rate_limit", 120),
+        page_workers=fmc_info_json.get("page_workers", 4),
+    )
+    # In multi domain mode, the domains are selected by the config file and the CSV file instead of the user
+    if "domains" not in fmc_info_json:
+        fmc = get_domains(fmc)
+    bulk_add_acps(fmc)